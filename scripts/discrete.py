@@ -66,15 +66,27 @@ plt.show()
 bs = np.linspace(0, 0.2, 10)
 ks = np.linspace(0, 0.2, 10)
 
-cts = np.zeros((len(bs), len(ks))) # create matrix of zeros
-for i, k in enumerate(ks): 
-    for j, b in enumerate(bs):
-        cts[i,j] = run_simulation_phase(b, k, T=10) # assign counts of infected to each element
+# counts of infected at T = 10 for every (b, k), averaged over replicates; the grid is evaluated in one batched computation
+# Note: this uses the chain binomial model, where the people infected in a period only infect others and recover
+# from the next period on; in the original run_simulation_phase they can do both in the same period, which gives
+# fewer infected at T = 10 (e.g. about 500 instead of 700 at b = 0.002, k = 0.1).
+# phase_diagram(bs, ks, replicates=20, T=10, phase=run_simulation_phase) gives the original model, much more slowly
+cts, stats = phase_diagram(bs, ks, replicates=20, T=10)
 plt.figure(figsize=(10,5))
 plt.imshow(cts, extent=[np.min(bs), np.max(bs), np.max(ks), np.min(ks)])
 plt.colorbar()
 plt.xlabel('b')
 plt.ylabel('k')
-plt.title('Phase diagram for Discrete Time w/ T = 10')
+plt.title('Phase diagram for Discrete Time w/ T = 10 (chain binomial model)')
 plt.show()
 
+# Adaptive phase diagram: only the cells near the epidemic threshold are refined
+points, cells = adaptive_phase_diagram(b_range=(0, 0.2), k_range=(0, 0.2), coarse=5, resolution=0.0025, replicates=20, T=10)
+plt.figure(figsize=(10,5))
+plt.scatter(points[:, 0], points[:, 1], c=points[:, 2], s=10)
+plt.colorbar()
+plt.gca().invert_yaxis() # same orientation as the uniform phase diagram
+plt.xlabel('b')
+plt.ylabel('k')
+plt.title('Adaptive phase diagram for Discrete Time w/ T = 10 (chain binomial model, {} points)'.format(len(points)))
+plt.show()
@@ -43,3 +43,33 @@ plt.title('SIR random, middle and corner epicenters')
 plt.legend()
 plt.show()
 
+
+# Sweep over the radius of infection: q is derived from b as above, and all radii share the same movement,
+# so the neighbor pairs are found once per time period for the whole sweep
+k = 0.1
+bs = [0.025, 0.05, 0.075, 0.1]
+qs = np.sqrt(1/(np.pi*100)*np.array(bs))
+counts_sus, counts_inf, counts_rec = discrete_spatial_sweep(k, qs, p=0.03, t=100, n=1000, num_agents=10)
+for b, inf in zip(bs, counts_inf):
+    plt.plot(inf, label='b={}'.format(b))
+plt.xlabel('t')
+plt.ylabel('infected pop')
+plt.title('SIR Discrete Spatial w/ different radii of infection, q')
+plt.legend()
+plt.show()
+
+
+# Same comparison averaged over 20 replicates per epicenter: the replicates of each epicenter run together,
+# with one neighbor search per time period for all of them
+k = 0.1
+b = 0.075
+q = np.sqrt(1/(np.pi*100)*b)
+for position, label in [(False, 'Random'), ('middle', 'Middle'), ('corner', 'Corner')]:
+    counts_sus, counts_inf, counts_rec = discrete_spatial_replicates(k, q, p=0.03, t=100, n=1000, position=position,
+                                                                     num_agents=10, replicates=20)
+    plt.plot(counts_inf.mean(axis=0), label=label)
+plt.xlabel('t')
+plt.ylabel('mean infected pop')
+plt.title('SIR random, middle and corner epicenters, mean of 20 replicates')
+plt.legend()
+plt.show()
@@ -5,6 +5,7 @@ This script contains the code to run simulations for the Stochastic SIR Model
 import sys
 sys.path.append('../')
 from sir.stochasticsir import *
+from sir.montecarlo import monte_carlo, sequential_monte_carlo
 import numpy as np 
 from numpy.random import randint, rand
 import matplotlib.pyplot as plt
@@ -16,13 +17,9 @@ ps = [0.1, 0.05] # chose values that are interesting after testing multiple comb
 Rs = [2, 14]
 for p in ps:
     for r in Rs:
-        simulations = []
-        for k in range(trials): # running 500 simulations           
-            result = stochastic_constant_contacts(p, r) 
-            infected = result[1]
-            maximum = max(infected) # get the peak of the pandemic for each simulation
-            simulations.append(maximum)
-        plt.hist(simulations) # plot the distribution
+        # running 500 simulations in shards; only the histogram of the peaks is kept
+        peaks = monte_carlo(p, r, trials=trials)['peak']
+        plt.bar(np.arange(peaks.counts.size), peaks.counts) # plot the distribution
         plt.xlabel('Maximum Number of Cases')
         plt.ylabel('Frequency')
         plt.title('Stochastic SIR with p = {} and R = {}'.format(p, r))
@@ -73,11 +70,8 @@ ps = [0.1, 0.01]
 Rs = [14]
 for p in ps:
     for r in Rs:
-        simulations = []
-        for k in range(trials): # 500 simulations           
-            result = stochastic_constant_contacts(p, r)[3] # gives the final time the pandemic ends
-            simulations.append(result)
-        plt.hist(simulations) # plot the distribution of the duration
+        durations = monte_carlo(p, r, trials=trials)['duration'] # histogram of the final time the pandemic ends
+        plt.bar(np.arange(durations.counts.size), durations.counts) # plot the distribution of the duration
         plt.xlabel('Duration of Pandemic')
         plt.ylabel('Frequency')
         plt.title('Stochastic SIR with p = {} and R = {}'.format(p, r))
@@ -87,19 +81,14 @@ for p in ps:
 
 # Comparing the effect of number of contacts for different recovery times
 # For peak of pandemic
-trials = 500
 p=0.1
 contacts = [i for i in range(1,11)] # number of contacts for each person
 Rs = [1,2,3,4]
 for R in Rs:
     mean_infected = [0] # create list containing means for each number of contacts
     for i in contacts:
-        simulations = []
-        for k in range(trials):            
-            result = stochastic_constant_contacts(p, R, contacts=i)[1]
-            Maximum = max(result)
-            simulations.append(Maximum) # get the peak of the pandemic
-        mean = np.mean(simulations)
+        # run batches of trials until the mean peak is known to within +-0.5 cases
+        mean = sequential_monte_carlo(p, R, target='mean', statistic='peak', tol=0.5, contacts=i)['estimate']
         mean_infected.append(mean) # get the mean for each R and each number of contacts
     plt.plot(mean_infected, label='R={}'.format(R), marker='o') # plot for each R
 plt.xlabel('Number of Contacts')
@@ -120,10 +109,7 @@ Rs = [1,2,3,4]
 for R in Rs:
     mean_infected = [0]
     for i in contacts:
-        simulations = []
-        for k in range(trials):            
-            result = stochastic_constant_contacts(p, R, contacts=i)[3]
-            simulations.append(result)
+        peaks, simulations = stochastic_ensemble(p, R, trials=trials, contacts=i)
         mean = np.mean(simulations)
         mean_infected.append(mean)
     plt.plot(mean_infected, label='R={}'.format(R), marker='o')
@@ -2,8 +2,13 @@
 This document contains the code for setting up the discrete agent model of disease spread. 
 """
 
-from numpy.random import randint, rand
 import numpy as np 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from sir.population import Population, SUSC, INF, REC
+from sir.rng import make_rng, spawn_rngs
+from sir.kernels import select_backend, seed_kernels, discrete_step
+from sir.transmission import log_arrays
 
 class Agent():
     """
@@ -33,10 +38,13 @@ class Agent():
             pass
 
 # functions to count the number of infected, recovered and susceptible at a given point in time
+# pop is either a list of Agent objects or a Population, which keeps running tallies
 def count_susc(pop):
     """
     Returns # of susceptible people
     """
+    if isinstance(pop, Population):
+        return pop.count_susc()
     return sum(p.state == 'S' for p in pop)
 
 
@@ -44,6 +52,8 @@ def count_infected(pop):
     """
     Returns # of infected people
     """
+    if isinstance(pop, Population):
+        return pop.count_infected()
     return sum(p.state == 'I' for p in pop)
 
 
@@ -51,29 +61,98 @@ def count_recovered(pop):
     """
     Returns # of recovered people
     """
+    if isinstance(pop, Population):
+        return pop.count_recovered()
     return sum(p.state == 'R' for p in pop)
 
 
 # function to run a simulation to return the trends in S, I and R
-def run_simulation(b, k, N=1_000, T=20):
+# every simulation takes rng, a numpy Generator or a seed for one (see sir.rng)
+def iter_simulation(b, k, N=1_000, T=20, rng=None, backend='python', log=None):
+    """
+    generator version of run_simulation
+    yields the number of people S, I and R at t = 0 and after each time period, so long runs can be streamed or stopped early
+    backend='numba' runs the update loop as a compiled kernel, 'auto' does so when numba is installed (see sir.kernels)
+    log is an optional sir.transmission.InfectionLog of size N, in which every infection (with its infector)
+        and recovery is recorded
+    """
+    rng = make_rng(rng)
+    backend = select_backend(backend)
+    if backend == 'numba':
+        seed_kernels(rng.integers(2**32)) # the compiled kernel draws from numba's random state, seeded from rng
+    pop = Population(N) # Generates our population
+    pop.change_state(0) # Creates patient zero
+    if log is not None:
+        log.infect(0, 0)
+    state = pop.state
+    yield count_susc(pop), count_infected(pop), count_recovered(pop)
+    for t in range(T):
+    # update the population
+        if backend == 'numba':
+            pop.tally(*discrete_step(state, b, k, t+1, *log_arrays(log)))
+        else:
+            for i in range(N):
+                if state[i] == INF: # if infected, then infect other susceptible people with p(infect) = b
+                    for j in range(N):
+                        if state[j] == SUSC:
+                            if rng.random() < b:
+                                pop.change_state(j)
+                                if log is not None:
+                                    log.infect(j, t+1, i) # j was infected by i during period t+1
+                    if rng.random() < k: # if infected, recover with p(recover) = k
+                        pop.change_state(i)
+                        if log is not None:
+                            log.recover(i, t+1)
+        yield count_susc(pop), count_infected(pop), count_recovered(pop)
+
+
+def run_simulation(b, k, N=1_000, T=20, rng=None, backend='python', log=None):
     """
     return the number of people S, I and R for each time period t
+    log is an optional sir.transmission.InfectionLog of size N, filled with the infection history (see iter_simulation)
     """    
-    pop = [Agent() for i in range(N)] # Generates our population
-    pop[0].change_state() # Creates patient zero
+    counts_sus = []
+    counts_inf = []
+    counts_rec = []
+    for sus, inf, rec in iter_simulation(b, k, N=N, T=T, rng=rng, backend=backend, log=log):
+        counts_sus.append(sus)
+        counts_inf.append(inf)
+        counts_rec.append(rec)
+
+    return counts_sus, counts_inf, counts_rec
+
+
+# array-backed version of run_simulation
+def run_simulation_array(b, k, N=1_000, T=20, sequential=False, rng=None):
+    """
+    return the number of people S, I and R for each time period t
+    the population is a Population, whose states are stored in a uint8 numpy array (SUSC, INF or REC for each person)
+    by default each step is a single vectorized update: every susceptible is infected with probability 1-(1-b)^I,
+        where I is the number of infected at the start of the step, and every one of those I recovers with probability k
+    sequential=True keeps the legacy update order of run_simulation: infected people are visited one at a time in order,
+        so someone infected earlier in the step can infect others (and recover) later in the same step
+    """
+    rng = make_rng(rng)
+    pop = Population(N) # our population
+    pop.change_state(0) # patient zero
+    state = pop.state
     counts_sus = [count_susc(pop)]
     counts_inf = [count_infected(pop)]
     counts_rec = [count_recovered(pop)]
     for t in range(T):
-    # update the population
-        for i in range(N):
-            if pop[i].state == 'I': # if infected, then infect other susceptible people with p(infect) = b
-                for j in range(N):
-                    if pop[j].state == 'S':
-                        if rand() < b:
-                            pop[j].change_state()
-                if rand() < k: # if infected, recover with p(recover) = k
-                    pop[i].change_state()
+        if sequential:
+            for i in range(N):
+                if state[i] == INF:
+                    sus = np.flatnonzero(state == SUSC)
+                    pop.infect(sus[rng.random(sus.size) < b]) # every susceptible gets its own draw, as in run_simulation
+                    if rng.random() < k:
+                        pop.change_state(i)
+        else:
+            inf = np.flatnonzero(state == INF)
+            sus = np.flatnonzero(state == SUSC)
+            prob = 1 - (1-b)**inf.size # probability of escaping all I infected people is (1-b)^I
+            pop.infect(sus[rng.random(sus.size) < prob])
+            pop.recover(inf[rng.random(inf.size) < k]) # only people infected at the start of the step recover
         counts_sus.append(count_susc(pop))
         counts_inf.append(count_infected(pop))
         counts_rec.append(count_recovered(pop))
@@ -81,21 +160,268 @@ def run_simulation(b, k, N=1_000, T=20):
     return counts_sus, counts_inf, counts_rec
 
 
+# count-level (chain binomial) version of run_simulation
+def run_simulation_binomial(b, k, N=1_000, T=20, rng=None):
+    """
+    return the number of people S, I and R for each time period t
+    since all agents are identical only the counts (S, I, R) are tracked:
+        new infections are drawn as Binomial(S, 1-(1-b)^I) and recoveries as Binomial(I, k)
+    this has the same distribution as run_simulation_array with sequential=False, at a cost independent of N
+    """
+    rng = make_rng(rng)
+    S, I, R = N - 1, 1, 0 # patient zero
+    counts_sus = [S]
+    counts_inf = [I]
+    counts_rec = [R]
+    for t in range(T):
+        new_inf = rng.binomial(S, 1 - (1-b)**I)
+        new_rec = rng.binomial(I, k)
+        S, I, R = S - new_inf, I + new_inf - new_rec, R + new_rec
+        counts_sus.append(int(S))
+        counts_inf.append(int(I))
+        counts_rec.append(int(R))
+
+    return counts_sus, counts_inf, counts_rec
+
+
+# hybrid stochastic-deterministic version of run_simulation
+def run_simulation_hybrid(b, k, N=1_000, T=20, threshold=100, rng=None):
+    """
+    return the number of people S, I and R for each time period t
+    while fewer than threshold people are infected the counts are drawn as in run_simulation_binomial;
+        once there are more, the outbreak is run with the mean-field ODE of sir.ode_function until the number
+        of infected drops below threshold again, and the last ODE state (rounded to whole people) is handed back
+        to the stochastic model for the end of the pandemic
+    the ODE rates match the per-step probabilities: b_ode = -log(1-b)*N, since 1-(1-b)^I = 1-exp(-b_ode*I/N),
+        and k_ode = -log(1-k), so a large outbreak costs one ODE solve instead of one draw per step
+    when b or k is 1 these rates are infinite (everyone is infected or recovers in one step),
+        so the simulation stays on the binomial steps throughout
+    """
+    from sir.ode_function import solve_until_below # only imported when needed, as it loads scipy.integrate and pyplot
+    rng = make_rng(rng)
+    use_ode = b < 1 and k < 1
+    if use_ode:
+        c = [-np.log(1-b)*N, -np.log(1-k)] # ODE rates for fractions of the population
+    S, I, R = N - 1, 1, 0 # patient zero
+    counts_sus = [S]
+    counts_inf = [I]
+    counts_rec = [R]
+    t = 0
+    while t < T:
+        if use_ode and I >= threshold:
+            ts, ys, crossed = solve_until_below(np.array([S, I, R])/N, c, t, T, threshold/N)
+            for y in ys[1:]:
+                S, I = int(round(y[0]*N)), int(round(y[1]*N))
+                R = N - S - I
+                counts_sus.append(S)
+                counts_inf.append(I)
+                counts_rec.append(R)
+            t = ts[-1]
+            if t == T:
+                break
+        # one stochastic step, which also moves on from the last ODE state when the threshold was crossed
+        new_inf = rng.binomial(S, 1 - (1-b)**I)
+        new_rec = rng.binomial(I, k)
+        S, I, R = S - new_inf, I + new_inf - new_rec, R + new_rec
+        counts_sus.append(int(S))
+        counts_inf.append(int(I))
+        counts_rec.append(int(R))
+        t = t + 1
+
+    return counts_sus, counts_inf, counts_rec
+
+
+# functions to run many replicates of the simulation at once
+def run_ensemble(b, k, N=1_000, T=20, replicates=100, counts_only=False, rng=None):
+    """
+    return the number of people S, I and R for each replicate and each time period t
+    all replicates are advanced together, with the same update as run_simulation_array (sequential=False):
+        by default the population is an (replicates, N) uint8 state matrix
+        counts_only=True tracks only the (replicates, 3) matrix of counts, as in run_simulation_binomial
+    returns counts_sus, counts_inf, counts_rec, each an array of shape (replicates, T+1)
+    """
+    rng = make_rng(rng)
+    counts = np.empty((3, replicates, T+1), dtype=np.int64)
+    if counts_only:
+        SIR = np.zeros((replicates, 3), dtype=np.int64)
+        SIR[:, SUSC] = N - 1
+        SIR[:, INF] = 1 # patient zero in every replicate
+        counts[:, :, 0] = SIR.T
+        for t in range(T):
+            new_inf = rng.binomial(SIR[:, SUSC], 1 - (1-b)**SIR[:, INF])
+            new_rec = rng.binomial(SIR[:, INF], k)
+            SIR[:, SUSC] -= new_inf
+            SIR[:, INF] += new_inf - new_rec
+            SIR[:, REC] += new_rec
+            counts[:, :, t+1] = SIR.T
+    else:
+        state = np.full((replicates, N), SUSC, dtype=np.uint8)
+        state[:, 0] = INF
+        counts[:, :, 0] = [[N - 1], [1], [0]]
+        for t in range(T):
+            sus = state == SUSC
+            inf = state == INF
+            prob = 1 - (1-b)**np.count_nonzero(inf, axis=1) # one infection probability per replicate
+            state[sus & (rng.random((replicates, N)) < prob[:, None])] = INF
+            state[inf & (rng.random((replicates, N)) < k)] = REC
+            for c in (SUSC, INF, REC):
+                counts[c, :, t+1] = np.count_nonzero(state == c, axis=1)
+    return counts[SUSC], counts[INF], counts[REC]
+
+
+def ensemble_mean(counts):
+    """
+    returns the mean over replicates of a (replicates, T+1) count array, for each time period t
+    """
+    return np.mean(counts, axis=0)
+
+
+def ensemble_quantiles(counts, q=(0.05, 0.5, 0.95)):
+    """
+    returns the quantiles q over replicates of a (replicates, T+1) count array
+    the result has shape (len(q), T+1), e.g. the lower band, median and upper band for the default q
+    """
+    return np.quantile(counts, q, axis=0)
+
+
 # function to construct phase diagram
-def run_simulation_phase(b, k, N=1_000, T=10):
+def run_simulation_phase(b, k, N=1_000, T=10, rng=None):
     """
     return the number of people infected at time T
     """
-    pop = [Agent() for i in range(N)] # our population
-    pop[0].change_state()
+    rng = make_rng(rng)
+    pop = Population(N) # our population
+    pop.change_state(0)
+    state = pop.state
     for t in range(T):
     # update the population
         for i in range(N):
-            if pop[i].state == 'I':
+            if state[i] == INF:
                 for j in range(N):
-                    if pop[j].state == 'S':
-                        if rand() < b:
-                            pop[j].change_state()
-                if rand() < k:
-                    pop[i].change_state()
-    return count_infected(pop)
\ No newline at end of file
+                    if state[j] == SUSC:
+                        if rng.random() < b:
+                            pop.change_state(j)
+                if rng.random() < k:
+                    pop.change_state(i)
+    return count_infected(pop)
+
+
+# count-level version of run_simulation_phase
+def run_simulation_phase_binomial(b, k, N=1_000, T=10, rng=None):
+    """
+    return the number of people infected at time T
+    uses the chain binomial update of run_simulation_binomial
+    """
+    rng = make_rng(rng)
+    S, I = N - 1, 1
+    for t in range(T):
+        new_inf = rng.binomial(S, 1 - (1-b)**I)
+        new_rec = rng.binomial(I, k)
+        S, I = S - new_inf, I + new_inf - new_rec
+    return int(I)
+
+
+# vectorized phase diagram
+def _phase_chunk(bs, ks, rngs, replicates, T, N, phase=None):
+    """
+    returns the number of people infected at time T for every (k, b, replicate), shape (len(ks), len(bs), replicates)
+    all cells of a row are advanced together with the chain binomial update of run_simulation_phase_binomial,
+        or each cell and replicate is run with phase when it is given
+    rngs holds one Generator per row, so a row gives the same result whichever chunk or process evaluates it
+    """
+    b = np.asarray(bs, dtype=float)[:, None]
+    infected = np.empty((len(ks), len(bs), replicates), dtype=np.int64)
+    for row, (k, rng) in enumerate(zip(ks, rngs)):
+        if phase is not None:
+            infected[row] = [[phase(b_j, k, N=N, T=T, rng=rng) for r in range(replicates)] for b_j in bs]
+            continue
+        S = np.full((len(bs), replicates), N - 1, dtype=np.int64)
+        I = np.ones((len(bs), replicates), dtype=np.int64)
+        for t in range(T):
+            new_inf = rng.binomial(S, 1 - (1-b)**I)
+            new_rec = rng.binomial(I, k)
+            S = S - new_inf
+            I = I + new_inf - new_rec
+        infected[row] = I
+    return infected
+
+
+def phase_diagram(bs, ks, replicates=1, T=10, N=1_000, processes=1, phase=None, rng=None):
+    """
+    return the mean number of people infected at time T for every pair (b, k), together with per-cell statistics
+    cts[i, j] corresponds to k = ks[i] and b = bs[j], as in the phase diagram of scripts/discrete.py
+    by default the whole grid is one batched chain binomial computation (the model of run_simulation_phase_binomial):
+        the people infected in a time period are infected by those infected at its start and cannot recover before
+        the next one, whereas in run_simulation_phase people infected earlier in a period can infect others and
+        recover in the same period, which gives noticeably different counts (fewer infected at T for most b and k)
+    phase=run_simulation_phase (or any function with the arguments (b, k, N, T, rng)) evaluates every cell and
+        replicate with that function instead, e.g. to keep the within-period order of the original model
+    with processes > 1 (or None for all cores) the rows of the grid are split into chunks which are evaluated
+        in a process pool
+    every row gets its own random stream spawned from rng, so for a given seed the result does not depend on processes
+    stats is a dictionary of (len(ks), len(bs)) arrays: 'mean', 'std', 'min', 'max' of the replicates
+        and 'extinct', the fraction of replicates with no one infected at time T
+    """
+    ks = np.asarray(ks, dtype=float)
+    rngs = spawn_rngs(rng, len(ks))
+    if processes == 1:
+        infected = _phase_chunk(bs, ks, rngs, replicates, T, N, phase)
+    else:
+        processes = processes or os.cpu_count()
+        chunks = [chunk for chunk in np.array_split(np.arange(len(ks)), processes) if chunk.size > 0]
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_phase_chunk, bs, ks[chunk], rngs[chunk[0]:chunk[-1]+1], replicates, T, N, phase)
+                       for chunk in chunks]
+            infected = np.concatenate([f.result() for f in futures], axis=0)
+    stats = {
+        'mean': infected.mean(axis=2),
+        'std': infected.std(axis=2),
+        'min': infected.min(axis=2),
+        'max': infected.max(axis=2),
+        'extinct': np.mean(infected == 0, axis=2),
+    }
+    return stats['mean'], stats
+
+
+# adaptive phase diagram
+def adaptive_phase_diagram(b_range=(0, 0.2), k_range=(0, 0.2), coarse=5, resolution=0.01, replicates=10, T=10, N=1_000,
+                           tol=0.2, phase=run_simulation_phase_binomial, rng=None):
+    """
+    return the phase diagram sampled adaptively around the epidemic threshold
+    starts from a coarse x coarse grid over b_range x k_range and recursively splits a cell into four
+        while its corners disagree (their mean infected counts differ by more than tol*N)
+        or one of its corners has a high replicate spread (standard deviation above tol*N),
+        until the cells are no larger than resolution
+    phase is the function evaluated at every point, replicates times: run_simulation_phase or any function
+        with the same arguments (b, k, N, T, rng); by default the faster run_simulation_phase_binomial
+    returns points, an (M, 4) array of rows (b, k, mean, std) for every point simulated,
+        and cells, an (L, 4) array of rows (b0, b1, k0, k1) for the final cells
+    """
+    rng = make_rng(rng)
+    results = {} # (b, k) -> (mean, std) of the replicates, so shared corners are only simulated once
+
+    def evaluate(b, k):
+        if (b, k) not in results:
+            cts = [phase(b, k, N=N, T=T, rng=rng) for r in range(replicates)]
+            results[(b, k)] = (np.mean(cts), np.std(cts))
+        return results[(b, k)]
+
+    bs = np.linspace(b_range[0], b_range[1], coarse)
+    ks = np.linspace(k_range[0], k_range[1], coarse)
+    todo = [(bs[j], bs[j+1], ks[i], ks[i+1], 0) for i in range(coarse - 1) for j in range(coarse - 1)]
+    width = max(bs[1] - bs[0], ks[1] - ks[0])
+    max_depth = max(int(np.ceil(np.log2(width/resolution) - 1e-9)), 0) # number of halvings to reach the resolution
+    cells = []
+    while todo:
+        b0, b1, k0, k1, depth = todo.pop()
+        corners = np.array([evaluate(b, k) for b in (b0, b1) for k in (k0, k1)])
+        means, stds = corners[:, 0], corners[:, 1]
+        interesting = np.ptp(means) > tol*N or np.max(stds) > tol*N
+        if interesting and depth < max_depth:
+            bm, km = (b0 + b1)/2, (k0 + k1)/2
+            depth += 1
+            todo.extend([(b0, bm, k0, km, depth), (bm, b1, k0, km, depth), (b0, bm, km, k1, depth), (bm, b1, km, k1, depth)])
+        else:
+            cells.append((b0, b1, k0, k1))
+    points = np.array([(b, k, mean, std) for (b, k), (mean, std) in results.items()])
+    return points, np.array(cells)
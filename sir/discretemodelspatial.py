@@ -1,6 +1,9 @@
 import numpy as np
-import random
 from scipy.spatial import KDTree
+from sir.population import Population, SUSC, INF, REC
+from sir.rng import make_rng, spawn_rngs
+from sir.kernels import select_backend, seed_kernels, spatial_step
+from sir.transmission import log_arrays
 
 
 class AgentSpatial:
@@ -10,9 +13,10 @@ class AgentSpatial:
     This class provides methods to return the state of an individual and also to change it.
     """
 
-    def __init__(self, p=None):
+    def __init__(self, p=None, rng=None):
+        self.rng = make_rng(rng) # random number generator used for the position and the moves
         self.state = 'S'
-        self.pos = np.random.rand(2)
+        self.pos = self.rng.random(2)
         if p:
             self.p = p
         else:
@@ -39,9 +43,7 @@ class AgentSpatial:
         """
         Change position of agent by p
         """
-        dpos = np.empty(2)
-        dpos[0] = random.choice([-1, 1])*np.random.randn(1)
-        dpos[1] = random.choice([-1, 1])*np.random.randn(1)
+        dpos = self.rng.standard_normal(2) # normal components (symmetric, so no random sign is needed) give a uniform direction
         dpos = self.p*dpos/np.linalg.norm(dpos)
 
         if 0 <= self.pos[0] + dpos[0] <= 1 and 0 <= self.pos[1] + dpos[1] <= 1:
@@ -52,12 +54,190 @@ class AgentSpatial:
     def initial_position(self, position):
         """
         """
-        self.pos = position
+        self.pos = np.array(position, dtype=float)
+
+def initial_positions(n, position, num_agents, rng):
+    """
+    Returns the (n, 2) array of starting positions: uniform on [0,1]x[0,1], except that the first num_agents agents
+    (the initially infected) all start in the middle or in the corner when position is 'middle' or 'corner'
+    """
+    pos = rng.random((n, 2))
+    if position == 'middle':
+        pos[:num_agents] = [0.5, 0.5]
+    elif position == 'corner':
+        pos[:num_agents] = [0, 0]
+    return pos
+
+
+def move_positions(pos, p, rng):
+    """
+    Moves all agents at once, as change_pos does for one agent
+    pos is the (n, 2) array of positions, updated in place, and p the step size: one number or an array with one per agent
+    Every agent takes a step of length p in a uniformly random direction, unless it would leave [0,1]x[0,1]
+    """
+    _take_steps(pos, rng.standard_normal(pos.shape), p)
+
+
+def _take_steps(pos, dpos, p):
+    """
+    Moves the agents in the directions of dpos by steps of length p, unless they would leave [0,1]x[0,1]
+    """
+    dpos *= (np.asarray(p)/np.linalg.norm(dpos, axis=1))[:, None]
+    new = pos + dpos
+    inside = np.all((0 <= new) & (new <= 1), axis=1) # agents whose move stays inside the grid
+    pos[inside] = new[inside]
+
+
+def _counting_order(keys):
+    """
+    Returns the stable order that sorts an array of non-negative integers, in O(n) per 16 bits of the largest one
+    numpy's stable sort is a radix sort for 16-bit integers, so the keys are sorted 16 bits at a time (LSD radix sort)
+    """
+    order = np.argsort((keys & 0xFFFF).astype(np.uint16), kind='stable')
+    shift = 16
+    while keys.size > 0 and keys.max() >> shift:
+        digit = ((keys[order] >> shift) & 0xFFFF).astype(np.uint16)
+        order = order[np.argsort(digit, kind='stable')]
+        shift += 16
+    return order
+
+
+class CellList:
+    """
+    This class bins agents into a uniform grid over the unit square, with m x m cells of side 1/m >= q,
+    so only agents in the same or one of the 8 neighboring cells can be within distance q of each other.
+    The agents are grouped by cell once (bincount for the start of every cell, a radix sort for their order),
+    then each query lists the binned agents in the 3 x 3 cells around other agents with np.repeat, all vectorized.
+    key optionally gives every agent an integer in 0, ..., keys-1, which is added to the cell hash, so agents
+    with different keys (e.g. separate replicates sharing the unit square) are never paired.
+    """
+
+    def __init__(self, pos, b, q, key=None, keys=1):
+        m = int(np.sqrt(b.size/keys)) + 1 # enough cells for about one agent per cell
+        if q > 0:
+            m = max(1, min(m, int(1/q)))
+        self.m = m
+        self.pos = pos
+        self.key = key
+        self.cells = np.minimum((pos*m).astype(np.int64), m - 1) # cell of every agent (x = 1 goes in the last one)
+        cell_b = self._hash(b, self.cells[b, 0], self.cells[b, 1])
+        self.order = b[_counting_order(cell_b)] # binned agents grouped by cell
+        self.count = np.bincount(cell_b, minlength=keys*m*m)
+        self.start = np.cumsum(self.count) - self.count
+
+    def _hash(self, a, cx, cy):
+        """
+        Returns the index of cell (cx, cy) for the agents in a, within the block of cells of their key
+        """
+        c = cx*self.m + cy
+        if self.key is not None:
+            c += self.key[a]*self.m*self.m
+        return c
+
+    def query(self, a, q, return_distances=False):
+        """
+        Returns the pairs (i, j), i in a and j a binned agent, at distance at most q (no more than the cell side)
+        as two arrays i and j, and also their squared distances if return_distances is True
+        the cost is O(a.size) plus the number of candidate pairs in neighboring cells
+        """
+        m = self.m
+        pos = self.pos
+        pairs_i = []
+        pairs_j = []
+        pairs_d2 = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cx = self.cells[a, 0] + dx
+                cy = self.cells[a, 1] + dy
+                ok = (0 <= cx) & (cx < m) & (0 <= cy) & (cy < m)
+                c = self._hash(a[ok], cx[ok], cy[ok])
+                num = self.count[c]
+                i = np.repeat(a[ok], num)
+                j = self.order[np.repeat(self.start[c] - (np.cumsum(num) - num), num) + np.arange(num.sum())]
+                d2 = np.sum((pos[i] - pos[j])**2, axis=1)
+                close = d2 <= q*q
+                pairs_i.append(i[close])
+                pairs_j.append(j[close])
+                pairs_d2.append(d2[close])
+        if return_distances:
+            return np.concatenate(pairs_i), np.concatenate(pairs_j), np.concatenate(pairs_d2)
+        return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def cell_pairs(pos, a, b, q):
+    """
+    Returns the pairs of agents (i, j), i in a and j in b (arrays of agent indices), at distance at most q,
+    as two arrays i and j, by binning b in a CellList: the cost is O(n) plus the number of candidate pairs
+    """
+    return CellList(pos, b, q).query(a, q)
+
+
+class VerletList:
+    """
+    This class keeps a Verlet list for the infections of the spatial model: the susceptible-infected pairs that were
+    within distance q + skin at reference positions, taken when the list is built.
+    While no agent has moved more than skin/2 from its reference position, every pair now within q was within q + skin
+    there, so only the listed pairs need their exact distance checked.
+    People infected later add their pairs by querying a CellList of the susceptibles at the reference positions,
+    and pairs whose susceptible got infected or whose infected recovered are dropped for good.
+    The list is only rebuilt once some agent has moved further than skin/2, so with small steps most time periods
+    cost O(listed pairs + new infections) instead of O(n).
+    With many agents some agent nearly always moves straight, so a list lasts about skin/(2p) periods for steps of
+    length p, and it holds about ((q+skin)/q)**2 times the pairs within q. It therefore only pays off when skin is
+    much larger than p (lists lasting tens of periods) and there are few pairs within q + skin compared to n, so that
+    the O(n) search from scratch dominates: e.g. about 2x faster for n = 200000, q = 0.005, p = 0.0001 and skin from
+    q/8 to q/2. With many pairs within q (n = 100000, q = 0.0155) it is slower even for p = 0.0001, and for steps
+    p = 0.01-0.05 the lists would have to be rebuilt every period or two, which is several times slower.
+    As a guard, once a list lasts fewer than min_periods periods the pairs are found from scratch for good.
+    """
+
+    min_periods = 4 # shortest useful life of a list, in time periods
+
+    def __init__(self, q, skin):
+        self.q = q
+        self.skin = skin
+        self.ref = None # positions when the list was last built
+        self.rebuilds = 0
+        self.periods = 0 # time periods served by the current list
+        self.fallback = False # True once the lists are given up for the search from scratch
+
+    def pairs(self, pos, state):
+        """
+        Returns the susceptible-infected pairs within distance q as two arrays: the susceptibles and the infected
+        """
+        r = self.q + self.skin
+        if self.ref is not None and np.max(np.sum((pos - self.ref)**2, axis=1)) > (self.skin/2)**2:
+            self.fallback = self.periods < self.min_periods # rebuilt too often to pay off
+            self.ref = None
+        if self.fallback:
+            return cell_pairs(pos, np.flatnonzero(state == SUSC), np.flatnonzero(state == INF), self.q)
+        if self.ref is None:
+            self.ref = pos.copy()
+            self.periods = 0
+            self.cells = CellList(self.ref, np.flatnonzero(state == SUSC), r)
+            self.listed = state == INF # infected people whose pairs are in the list
+            self.inf, self.sus = self.cells.query(np.flatnonzero(self.listed), r)
+            self.rebuilds += 1
+        else:
+            new = np.flatnonzero((state == INF) & ~self.listed)
+            inf, sus = self.cells.query(new, r)
+            self.sus = np.concatenate((self.sus, sus))
+            self.inf = np.concatenate((self.inf, inf))
+            self.listed[new] = True
+        self.periods += 1
+        keep = (state[self.sus] == SUSC) & (state[self.inf] == INF) # people never become S or I again
+        self.sus = self.sus[keep]
+        self.inf = self.inf[keep]
+        close = np.sum((pos[self.sus] - pos[self.inf])**2, axis=1) <= self.q**2
+        return self.sus[close], self.inf[close]
+
 
 def count_susc(pop):
     """
     Returns # of susceptible people
     """
+    if isinstance(pop, Population):
+        return pop.count_susc()
     return sum(p.state == 'S' for p in pop)
 
 
@@ -65,6 +245,8 @@ def count_infected(pop):
     """
     Returns # of infected people
     """
+    if isinstance(pop, Population):
+        return pop.count_infected()
     return sum(p.state == 'I' for p in pop)
 
 
@@ -72,58 +254,182 @@ def count_recovered(pop):
     """
     Returns # of recovered people
     """
+    if isinstance(pop, Population):
+        return pop.count_recovered()
     return sum(p.state == 'R' for p in pop)
 
 
-def discrete_spatial_simulation(k, q, p=None, n=1000, t=20, position=False, num_agents=5):
+def iter_discrete_spatial_simulation(k, q, p=None, n=1000, t=20, position=False, num_agents=5, rng=None,
+                                     backend='python', log=None, skin=None):
     """
-    Runs a spatial SIR simulation given:
-        k=rate of recovery, q=radius of infection, p=step_size, n=population, t=time
-    Returns number of S, I and R individuals at time t
+    Generator version of discrete_spatial_simulation
+    Yields number of S, I and R individuals at time 0 and after each time period
     """
-    pop = [AgentSpatial(p) for i in range(n)] # Generates our population
+    rng = make_rng(rng)
+    backend = select_backend(backend, ('python', 'numba', 'cells'))
+    if backend == 'numba':
+        seed_kernels(rng.integers(2**32))
+    if skin is not None:
+        if backend != 'cells':
+            raise ValueError("skin is only used by backend='cells'")
+        verlet = VerletList(q, skin)
+    if p is None:
+        p = 0.01
+    pos = initial_positions(n, position, num_agents, rng) # Generates our population: positions in one (n, 2) array
+    pop = Population(n) # and states
+    for i in range(num_agents):
+        pop.change_state(i)
 
-    if position == 'middle':
-        middle = [0.5, 0.5]
-        for i in range(num_agents):
-            pop[i].change_state()
-            pop[i].initial_position(middle)
+    state = pop.state
+    if log is not None:
+        log.infect(np.arange(num_agents), 0)
+    yield count_susc(pop), count_infected(pop), count_recovered(pop)
 
-    elif position == 'corner':
-        corner = [0, 0]
-        for i in range(num_agents):
-            pop[i].change_state()
-            pop[i].initial_position(corner)
+    for t in range(t):
+        move_positions(pos, p, rng)
+        if backend == 'numba':
+            pop.tally(*spatial_step(state, pos, q, k, t+1, *log_arrays(log)))
+        elif backend == 'cells':
+            inf = np.flatnonzero(state == INF)
+            if skin is None:
+                i, j = cell_pairs(pos, np.flatnonzero(state == SUSC), inf, q) # susceptible-infected pairs within q
+            else:
+                i, j = verlet.pairs(pos, state)
+            new, first = np.unique(i, return_index=True)
+            rec = inf[rng.random(n)[inf] < k] # one draw per agent, as in discrete_spatial_sweep
+            pop.infect(new)
+            pop.recover(rec)
+            if log is not None:
+                log.infect(new, t+1, j[first]) # one of the infected within q is recorded as the infector
+                log.recover(rec, t+1)
+        else:
+            tree = KDTree(pos)
+            for i in range(n):
+                if state[i] == INF:
+                    inds = tree.query_ball_point(pos[i], q)
+                    for ind in inds:
+                        if state[ind] == SUSC:
+                            pop.change_state(ind)
+                            if log is not None:
+                                log.infect(ind, t+1, i)
+                    if rng.random() < k:
+                        pop.change_state(i)
+                        if log is not None:
+                            log.recover(i, t+1)
 
-    else:
-        for i in range(num_agents):
-            pop[i].change_state()
+        yield count_susc(pop), count_infected(pop), count_recovered(pop)
 
-    counts_sus = [count_susc(pop)]
-    counts_inf = [count_infected(pop)]
-    counts_rec = [count_recovered(pop)]
 
-    for t in range(t):
-        position = []
-        for p in pop:
-            p.change_pos()
-            position.append(p.pos)
-        tree = KDTree(position)
-        for i in range(n):
-            if pop[i].state == 'I':
-                inds = tree.query_ball_point(position[i], q)
-                for ind in inds:
-                    if pop[ind].state == 'S':
-                        pop[ind].change_state()
-                if np.random.rand() < k:
-                    pop[i].change_state()
-
-        counts_sus.append(count_susc(pop))
-        counts_inf.append(count_infected(pop))
-        counts_rec.append(count_recovered(pop))
+def discrete_spatial_simulation(k, q, p=None, n=1000, t=20, position=False, num_agents=5, rng=None, backend='python',
+                                log=None, skin=None):
+    """
+    Runs a spatial SIR simulation given:
+        k=rate of recovery, q=radius of infection, p=step_size (default 0.01, or an array with one step size per agent),
+        n=population, t=time
+        rng=random number generator or seed (see sir.rng)
+        backend='python', or 'numba' for the compiled infection loop ('auto' uses numba when installed, see sir.kernels)
+            both visit the infected in order, so people infected earlier in a time period can infect others in it;
+            or 'cells' to find all susceptible-infected pairs within q at once with a cell list (see cell_pairs), in O(n)
+            per time period: only the people infected at the start of a period infect others, and then recover with
+            probability k
+        skin=with backend='cells', keep the pairs within q+skin in a VerletList, which is only rebuilt once some agent
+            has moved more than skin/2; this only helps for steps p much smaller than skin and few pairs within q,
+            and falls back to the search from scratch when the lists last fewer than a few periods (see VerletList);
+            None finds the pairs from scratch every period
+        log=optional sir.transmission.InfectionLog of size n, filled with every infection (and infector) and recovery
+    Returns number of S, I and R individuals at time t
+    """
+    counts_sus = []
+    counts_inf = []
+    counts_rec = []
+    records = iter_discrete_spatial_simulation(k, q, p=p, n=n, t=t, position=position, num_agents=num_agents, rng=rng,
+                                               backend=backend, log=log, skin=skin)
+    for sus, inf, rec in records:
+        counts_sus.append(sus)
+        counts_inf.append(inf)
+        counts_rec.append(rec)
 
     return counts_sus, counts_inf, counts_rec
 
 
+def discrete_spatial_sweep(k, qs, p=None, n=1000, t=20, position=False, num_agents=5, rng=None):
+    """
+    Runs discrete_spatial_simulation with backend='cells' for every radius of infection in qs at once
+    All radii share the same movement of the agents and the same recovery draws, so they only differ through q,
+    and the neighbor search is done once per time period: the pairs of a person who is susceptible for some radius
+    and a person who is infected for some radius are found within max(qs) together with their distances,
+    grouped by the smallest radius they are within, and each radius only looks at the pairs within its q
+    This works best for radii close enough that their epidemics overlap, since the pairs searched are those of
+    the union of all runs
+    By the shared random numbers, the run for each q is exactly discrete_spatial_simulation(backend='cells')
+    with the same rng
+    Returns the number of S, I and R individuals at each time, as three arrays of shape (len(qs), t+1)
+    """
+    rng = make_rng(rng)
+    if p is None:
+        p = 0.01
+    qs = np.asarray(qs, dtype=float)
+    by_radius = np.argsort(qs)
+    radii = qs[by_radius]
+    qmax = radii[-1]
+    pos = initial_positions(n, position, num_agents, rng)
+    states = np.full((len(qs), n), SUSC, dtype=np.uint8) # one row of states per radius
+    states[:, :num_agents] = INF
+    counts = np.zeros((3, len(qs), t+1), dtype=np.int64)
+    for step in range(t+1):
+        if step > 0:
+            move_positions(pos, p, rng)
+            sus = np.flatnonzero(np.any(states == SUSC, axis=0))
+            inf = np.flatnonzero(np.any(states == INF, axis=0))
+            i, j, d2 = CellList(pos, inf, qmax).query(sus, qmax, return_distances=True)
+            # group the pairs by the smallest radius they are within, so the pairs within q are a prefix for every q
+            level = np.searchsorted(radii**2, d2).astype(np.int16)
+            order = np.argsort(level, kind='stable') # radix sort for small integers, O(pairs)
+            i, j = i[order], j[order]
+            ends = np.cumsum(np.bincount(level, minlength=len(qs)))
+            recover = (states == INF) & (rng.random(n) < k) # infected at the start of the period
+            for rank, r in enumerate(by_radius):
+                state = states[r]
+                hit = (state[i[:ends[rank]]] == SUSC) & (state[j[:ends[rank]]] == INF)
+                state[i[:ends[rank]][hit]] = INF
+            states[recover] = REC
+        for s in (SUSC, INF, REC):
+            counts[s, :, step] = np.sum(states == s, axis=1)
+    return counts[SUSC], counts[INF], counts[REC]
 
 
+def discrete_spatial_replicates(k, q, p=None, n=1000, t=20, position=False, num_agents=5, replicates=10, rng=None):
+    """
+    Runs replicates independent copies of discrete_spatial_simulation with backend='cells' together
+    The positions are stored in one (replicates, n, 2) array and the states in one (replicates, n) array, and each
+    time period moves every agent and finds the susceptible-infected pairs within q of all replicates at once,
+    in a single CellList whose cell hash includes the replicate, so there is no Python loop over the replicates
+    except to draw their random numbers
+    Every replicate uses its own random stream spawned from rng (see sir.rng.spawn_rngs), so replicate r is exactly
+    discrete_spatial_simulation(backend='cells') with rng=spawn_rngs(rng, replicates)[r]
+    p can be one step size or an array with one per agent, shared by all replicates
+    Returns the number of S, I and R individuals at each time, as three arrays of shape (replicates, t+1)
+    """
+    rngs = spawn_rngs(rng, replicates)
+    if p is None:
+        p = 0.01
+    p = np.broadcast_to(p, (replicates, n)).reshape(-1)
+    pos = np.stack([initial_positions(n, position, num_agents, r) for r in rngs])
+    states = np.full((replicates, n), SUSC, dtype=np.uint8)
+    states[:, :num_agents] = INF
+    flat_pos = pos.reshape(-1, 2) # views of all agents of all replicates, one after the other
+    flat_state = states.reshape(-1)
+    key = np.repeat(np.arange(replicates), n) # replicate of every agent
+    counts = np.zeros((3, replicates, t+1), dtype=np.int64)
+    for step in range(t+1):
+        if step > 0:
+            _take_steps(flat_pos, np.concatenate([r.standard_normal((n, 2)) for r in rngs]), p)
+            inf = np.flatnonzero(flat_state == INF)
+            cells = CellList(flat_pos, inf, q, key=key, keys=replicates)
+            i, j = cells.query(np.flatnonzero(flat_state == SUSC), q)
+            draws = np.concatenate([r.random(n) for r in rngs])
+            flat_state[np.unique(i)] = INF
+            flat_state[inf[draws[inf] < k]] = REC # infected at the start of the period
+        for s in (SUSC, INF, REC):
+            counts[s, :, step] = np.sum(states == s, axis=1)
+    return counts[SUSC], counts[INF], counts[REC]
@@ -0,0 +1,122 @@
+"""
+This document contains the continuous-time stochastic counterparts of the ODE model in sir.ode_function.
+Both engines simulate the mass-action SIR with the same b and k as f:
+    infection S -> I at rate b*S*I/N and recovery I -> R at rate k*I,
+so S/N, I/N and R/N follow the ODE solution as N grows.
+The state is only the counts (S, I) of each replicate, and replicates are advanced together as numpy arrays.
+"""
+
+import numpy as np
+from sir.rng import make_rng
+
+
+def _leap_size(S, I, a1, a2, eps):
+    """
+    returns the largest leap over which the propensities change by about a fraction eps at most
+    (the tau selection of Cao, Gillespie and Petzold, 2006, with g = 2 for both S and I)
+    """
+    bound_S = np.maximum(eps*S/2, 1)
+    bound_I = np.maximum(eps*I/2, 1)
+    mu_S, var_S = a1, a1 # mean and variance of the change in S per unit time (up to sign)
+    mu_I, var_I = np.abs(a1 - a2), a1 + a2
+    with np.errstate(divide='ignore'):
+        return np.minimum.reduce([bound_S/mu_S, bound_S**2/var_S, bound_I/mu_I, bound_I**2/var_I])
+
+
+def _simulate(b, k, N, I0, t_eval, replicates, eps, rng):
+    """
+    runs the replicates until the last time of t_eval, with exact steps (eps=None) or adaptive tau-leaping
+    returns the counts S, I and R at each time of t_eval, as arrays of shape (replicates, len(t_eval))
+    """
+    rng = make_rng(rng)
+    t_eval = np.asarray(t_eval, dtype=float)
+    n_eval = t_eval.size
+    out = np.zeros((3, replicates, n_eval), dtype=np.int64)
+    S = np.full(replicates, N - I0, dtype=np.int64)
+    I = np.full(replicates, I0, dtype=np.int64)
+    t = np.zeros(replicates)
+    nxt = np.zeros(replicates, dtype=np.int64) # index of the next time of t_eval for every replicate
+    active = np.arange(replicates)
+    while active.size > 0:
+        # record the replicates that have reached their next time of t_eval
+        at = active[t[active] >= t_eval[nxt[active]]]
+        out[0, at, nxt[at]] = S[at]
+        out[1, at, nxt[at]] = I[at]
+        nxt[at] += 1
+        active = active[nxt[active] < n_eval]
+        # once I = 0 nothing changes any more: fill in the remaining times
+        ended = active[I[active] == 0]
+        for r in ended:
+            out[0, r, nxt[r]:] = S[r]
+        active = active[I[active] > 0]
+        if active.size == 0:
+            break
+        s, i = S[active], I[active]
+        a1 = b*s*i/N # infection propensity
+        a2 = k*i # recovery propensity
+        a0 = a1 + a2
+        until_eval = t_eval[nxt[active]] - t[active]
+        if eps is None:
+            exact = np.ones(active.size, dtype=bool)
+        else:
+            tau = _leap_size(s, i, a1, a2, eps)
+            exact = tau < 10/a0 # a leap would have fewer than about 10 events: use exact steps instead
+            # leaps, cut at the next time of t_eval; events are clipped so no count becomes negative
+            leap = ~exact
+            tau = np.minimum(tau[leap], until_eval[leap])
+            n_inf = np.minimum(rng.poisson(a1[leap]*tau), s[leap])
+            n_rec = np.minimum(rng.poisson(a2[leap]*tau), i[leap])
+            idx = active[leap]
+            S[idx] -= n_inf
+            I[idx] += n_inf - n_rec
+            t[idx] = np.where(tau == until_eval[leap], t_eval[nxt[idx]], t[idx] + tau)
+        # exact steps: one event, unless the next time of t_eval comes first
+        # (waiting times are memoryless, so stopping the clock there and drawing again is still exact)
+        idx = active[exact]
+        dt = rng.exponential(1/a0[exact])
+        reached = dt >= until_eval[exact]
+        event = idx[~reached]
+        infection = rng.random(event.size)*a0[exact][~reached] < a1[exact][~reached]
+        S[event[infection]] -= 1
+        I[event[infection]] += 1
+        I[event[~infection]] -= 1
+        t[event] += dt[~reached]
+        t[idx[reached]] = t_eval[nxt[idx[reached]]]
+    out[2] = N - out[0] - out[1]
+    return out
+
+
+def _shape(out, replicates):
+    """
+    returns the counts S, I and R, dropping the replicate axis for a single run
+    """
+    if replicates is None:
+        return out[0, 0], out[1, 0], out[2, 0]
+    return out[0], out[1], out[2]
+
+
+def gillespie(b, k, N=1_000, I0=1, t_eval=np.linspace(0, 100, 101), replicates=None, rng=None):
+    """
+    runs the mass-action SIR with Gillespie's exact stochastic simulation algorithm (one event at a time)
+    b and k are the infection and recovery rates of f in sir.ode_function, N the population size
+        and I0 the number of infected people at t = 0
+    t_eval are the times at which to record the counts, as with solve_ivp
+    replicates is the number of independent runs, advanced together; None runs a single one
+    the cost is one step per event, about twice the final size of the pandemic, so use tau_leaping for very large N
+    returns the counts S, I and R at each time of t_eval, of shape (len(t_eval),) or (replicates, len(t_eval))
+    """
+    out = _simulate(b, k, N, I0, t_eval, replicates or 1, None, rng)
+    return _shape(out, replicates)
+
+
+def tau_leaping(b, k, N=1_000, I0=1, t_eval=np.linspace(0, 100, 101), replicates=None, eps=0.03, rng=None):
+    """
+    runs the mass-action SIR with adaptive tau-leaping: over a leap of length tau the numbers of infections and
+        recoveries are Poisson with mean propensity*tau
+    eps controls the error: tau is chosen so the propensities change by a fraction about eps during a leap,
+        and when a leap would have fewer than about 10 events (small outbreaks) exact Gillespie steps are taken instead
+    the number of leaps grows like log(N)/eps, so N = 10^7 runs in seconds
+    arguments and return values are the same as for gillespie
+    """
+    out = _simulate(b, k, N, I0, t_eval, replicates or 1, eps, rng)
+    return _shape(out, replicates)
@@ -0,0 +1,139 @@
+"""
+This document contains optional JIT-compiled kernels for the sequential inner loops of the agent models.
+In these loops agents are visited in order, so someone infected earlier in a time period can infect others
+in the same period, which is why they cannot be fully vectorized.
+The kernels are compiled with numba when it is installed. Otherwise HAVE_NUMBA is False and the simulations
+fall back to their pure Python/NumPy loops (see select_backend).
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """
+        Stands in for numba.njit when numba is not installed: the functions are left as plain Python
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+# same codes as sir.population, repeated here so that numba sees them as compile-time constants
+SUSC = 0
+INF = 1
+REC = 2
+
+
+def select_backend(backend, choices=('python', 'numba')):
+    """
+    Returns the backend to use, one of choices, for backend = 'auto' or one of choices
+    'auto' picks numba when it is installed and the pure Python loops otherwise
+    """
+    if backend == 'auto':
+        return 'numba' if HAVE_NUMBA else 'python'
+    if backend == 'numba' and not HAVE_NUMBA:
+        raise ImportError("backend='numba' requires the numba package")
+    if backend not in choices:
+        raise ValueError("backend must be 'auto' or one of {}, not {!r}".format(choices, backend))
+    return backend
+
+
+@njit(cache=True)
+def seed_kernels(seed):
+    """
+    Seeds the random state used inside the compiled kernels (numba keeps its own, separate from numpy's)
+    """
+    np.random.seed(seed)
+
+
+@njit(cache=True)
+def discrete_step(state, b, k, t, t_inf, t_rec, infector):
+    """
+    One time period of run_simulation on the state array: every infected agent, in order,
+    infects each susceptible with probability b and then recovers with probability k
+    Unless t_inf is empty, the infections and recoveries are recorded at time t in t_inf, t_rec and infector
+    (the arrays of a sir.transmission.InfectionLog)
+    Returns the number of new infections and recoveries
+    """
+    N = state.shape[0]
+    log = t_inf.size > 0
+    new_inf = 0
+    new_rec = 0
+    for i in range(N):
+        if state[i] == INF:
+            for j in range(N):
+                if state[j] == SUSC:
+                    if np.random.random() < b:
+                        state[j] = INF
+                        new_inf += 1
+                        if log:
+                            t_inf[j] = t
+                            infector[j] = i
+            if np.random.random() < k:
+                state[i] = REC
+                new_rec += 1
+                if log:
+                    t_rec[i] = t
+    return new_inf, new_rec
+
+
+@njit(cache=True)
+def stochastic_step(state, t_firstinf, contacts, p, R, inf, t):
+    """
+    One time period of the stochastic_* models on the state array: a susceptible agent i with contacts[i] contacts
+    is infected with probability 1 - (1-(p*inf)/(N-1))**contacts[i] and an infected agent recovers R+1 periods
+    after its infection; t_firstinf holds the time of infection of every agent
+    Returns the number of new infections and recoveries
+    """
+    N = state.shape[0]
+    new_inf = 0
+    new_rec = 0
+    for i in range(N):
+        if state[i] == SUSC:
+            prob = 1 - (1-((p*inf)/(N-1)))**contacts[i]
+            if np.random.random() < prob:
+                state[i] = INF
+                t_firstinf[i] = t
+                new_inf += 1
+        if state[i] == INF:
+            if t_firstinf[i] == t-R-1:
+                state[i] = REC
+                new_rec += 1
+    return new_inf, new_rec
+
+
+@njit(cache=True)
+def spatial_step(state, pos, q, k, t, t_inf, t_rec, infector):
+    """
+    One time period of discrete_spatial_simulation on the state array, with pos the (n, 2) array of positions:
+    every infected agent, in order, infects all susceptibles within distance q and then recovers with probability k
+    Unless t_inf is empty, the infections and recoveries are recorded at time t as in discrete_step
+    Returns the number of new infections and recoveries
+    """
+    n = state.shape[0]
+    log = t_inf.size > 0
+    q2 = q*q
+    new_inf = 0
+    new_rec = 0
+    for i in range(n):
+        if state[i] == INF:
+            for j in range(n):
+                if state[j] == SUSC:
+                    dx = pos[j, 0] - pos[i, 0]
+                    dy = pos[j, 1] - pos[i, 1]
+                    if dx*dx + dy*dy <= q2:
+                        state[j] = INF
+                        new_inf += 1
+                        if log:
+                            t_inf[j] = t
+                            infector[j] = i
+            if np.random.random() < k:
+                state[i] = REC
+                new_rec += 1
+                if log:
+                    t_rec[i] = t
+    return new_inf, new_rec
@@ -0,0 +1,240 @@
+"""
+This document contains the Monte Carlo runners for the stochastic SIR model.
+Trials are reduced to summary statistics where they are simulated, and only mergeable histograms are kept,
+so memory and communication between processes do not grow with the number of trials.
+"""
+
+import numpy as np
+import os
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.special import ndtri
+from sir.stochasticsir import ensemble_summaries, cohort_step
+from sir.rng import make_rng, spawn_rngs
+
+# summary statistics of a trial, as returned by ensemble_summaries
+STATISTICS = ('peak', 'peak_time', 'duration', 'final_size')
+
+
+class Histogram():
+    """
+    This class represents a histogram of non-negative integer values, with one bin per value.
+    Histograms of separate batches of trials can be merged, and since every value has its own bin
+    the histogram is also an exact quantile sketch: quantiles, mean and standard deviation are exact.
+    """
+
+    def __init__(self, values=()):
+        self.counts = np.bincount(np.asarray(values, dtype=np.int64))
+
+    def __len__(self):
+        """
+        returns the number of values in the histogram
+        """
+        return int(self.counts.sum())
+
+    def add(self, values):
+        """
+        adds an array of values to the histogram
+        """
+        self.merge(Histogram(values))
+
+    def merge(self, other):
+        """
+        adds the values of another histogram to this one
+        """
+        if other.counts.size > self.counts.size:
+            self.counts, other_counts = other.counts.copy(), self.counts
+        else:
+            other_counts = other.counts
+        self.counts[:other_counts.size] += other_counts
+
+    def mean(self):
+        """
+        returns the mean of the values
+        """
+        return np.dot(np.arange(self.counts.size), self.counts)/len(self)
+
+    def std(self):
+        """
+        returns the standard deviation of the values
+        """
+        values = np.arange(self.counts.size)
+        return np.sqrt(np.dot((values - self.mean())**2, self.counts)/len(self))
+
+    def order_statistic(self, k):
+        """
+        returns the k-th smallest value (k = 1, ..., len(self)); k can be a number or an array
+        """
+        return np.searchsorted(np.cumsum(self.counts), k)
+
+    def quantile(self, q):
+        """
+        returns the q-quantile of the values (the smallest value with at least a fraction q of values at or below it)
+        q can be a number or an array
+        """
+        return self.order_statistic(np.maximum(np.asarray(q)*len(self), 1))
+
+
+def _farm_chunk(p, R, trials, N, contacts, rng):
+    """
+    runs trials simulations and returns one Histogram per summary statistic; the trajectories never leave the worker
+    """
+    summaries = ensemble_summaries(p, R, trials=trials, N=N, contacts=contacts, rng=rng)
+    return {name: Histogram(summaries[name]) for name in STATISTICS}
+
+
+def _shard_sizes(trials, chunk):
+    """
+    returns the sizes of the shards of at most chunk trials that trials are split into
+    """
+    return [chunk]*(trials // chunk) + ([trials % chunk] if trials % chunk else [])
+
+
+def _run_shards(p, R, sizes, rngs, N, contacts, histograms, pool=None):
+    """
+    simulates one shard of every size in sizes with its stream in rngs, serially or in pool (a ProcessPoolExecutor),
+    and merges each shard into histograms as soon as it is done, so shard results are never accumulated
+    """
+    if pool is None:
+        results = (_farm_chunk(p, R, size, N, contacts, rng) for size, rng in zip(sizes, rngs))
+    else:
+        # no list of the futures is kept: as_completed drops each one once it has been yielded
+        results = (future.result() for future in as_completed([pool.submit(_farm_chunk, p, R, size, N, contacts, rng)
+                                                               for size, rng in zip(sizes, rngs)]))
+    for result in results:
+        for name in STATISTICS:
+            histograms[name].merge(result[name])
+
+
+def _pool(processes):
+    """
+    returns a process pool for processes > 1 (None for all cores), or an empty context giving None for processes=1
+    """
+    if processes == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(processes or os.cpu_count())
+
+
+def monte_carlo(p, R, trials=10_000, N=200, contacts=4, chunk=1_000, processes=1, rng=None):
+    """
+    runs trials simulations of stochastic_constant_contacts and returns the distribution of their summary statistics
+    the trials are split into shards of at most chunk trials, which are simulated with ensemble_summaries
+        and spread over a process pool when processes > 1 (or None for all cores)
+    every shard gets its own random stream spawned from rng, so for a given seed the result does not depend on processes
+    returns a dictionary with one merged Histogram for each of 'peak', 'peak_time', 'duration' and 'final_size'
+    """
+    sizes = _shard_sizes(trials, chunk)
+    histograms = {name: Histogram() for name in STATISTICS}
+    with _pool(processes) as pool:
+        _run_shards(p, R, sizes, spawn_rngs(rng, len(sizes)), N, contacts, histograms, pool)
+    return histograms
+
+
+def sequential_monte_carlo(p, R, target='mean', statistic='peak', tol=1.0, q=0.5, minor=None, confidence=0.95,
+                           batch=500, max_trials=100_000, N=200, contacts=4, processes=1, chunk=None, rng=None):
+    """
+    runs batches of batch trials of stochastic_constant_contacts (as in monte_carlo) until the confidence interval
+        on the target reaches tol; like monte_carlo it only supports the model with a constant number of contacts
+    target is one of
+        'mean': mean of statistic ('peak', 'peak_time', 'duration' or 'final_size'), normal interval
+        'quantile': q-quantile of statistic, interval between the order statistics given by binomial bounds on the rank
+        'extinction': probability that the pandemic dies out with at most minor people ever infected
+            (default N // 10), Wilson score interval
+    stops when the half-width of the interval is at most tol, or after max_trials trials
+    with processes > 1 (or None for all cores) one process pool is used for all batches, and every batch is split
+        into shards of at most chunk trials, by default ceil(batch/processes) so each batch keeps all processes busy;
+        give chunk explicitly for results that do not depend on processes for a given seed
+    returns a dictionary with the 'estimate', the 'halfwidth' of the interval and the number of 'trials' used
+    """
+    z = ndtri(0.5 + confidence/2) # normal quantile
+    if minor is None:
+        minor = N // 10
+    if target == 'extinction':
+        statistic = 'final_size'
+    elif target not in ('mean', 'quantile'):
+        raise ValueError("unknown target '{}'".format(target))
+    if chunk is None:
+        chunk = -(-batch // (processes or os.cpu_count()))
+    nbatches = -(-max_trials // batch)
+    histograms = {name: Histogram() for name in STATISTICS}
+    hist = histograms[statistic]
+    with _pool(processes) as pool:
+        for i, stream in enumerate(spawn_rngs(rng, nbatches)):
+            size = min(batch, max_trials - i*batch)
+            sizes = _shard_sizes(size, chunk)
+            _run_shards(p, R, sizes, spawn_rngs(stream, len(sizes)), N, contacts, histograms, pool)
+            n = len(hist)
+            if target == 'mean':
+                estimate = hist.mean()
+                halfwidth = z*hist.std()/np.sqrt(n)
+            elif target == 'quantile':
+                estimate = hist.quantile(q)
+                spread = z*np.sqrt(n*q*(1 - q))
+                lower = hist.order_statistic(max(np.floor(n*q - spread), 1))
+                upper = hist.order_statistic(min(np.ceil(n*q + spread) + 1, n))
+                halfwidth = (upper - lower)/2
+            else:
+                estimate = hist.counts[:minor + 1].sum()/n
+                halfwidth = z*np.sqrt(estimate*(1 - estimate)/n + z**2/(4*n**2))/(1 + z**2/n)
+            if halfwidth <= tol:
+                break
+    return {'estimate': estimate, 'halfwidth': halfwidth, 'trials': n}
+
+
+def _splitting_stage(S, I, cohorts, t, p, R, N, contacts, level, statistic, rng):
+    """
+    advances the particles (count-level states of stochastic_constant_contacts, as in ensemble_summaries)
+    until their statistic reaches level or their pandemic ends
+    a particle reaches the level when I >= level for 'peak', or when I > 0 at time level-1 for 'duration'
+    returns the mask of the particles that reached the level; their states are left at the time they reached it
+    """
+    rows = np.arange(S.size)
+    hit = np.zeros(S.size, dtype=bool)
+    active = rows
+    while active.size > 0:
+        score = I[active] if statistic == 'peak' else np.where(I[active] > 0, t[active] + 1, 0)
+        reached = score >= level
+        hit[active[reached]] = True
+        active = active[~reached & (I[active] > 0)]
+        if active.size == 0:
+            break
+        t[active] += 1
+        prob = 1 - (1-((p*I[active])/(N-1)))**contacts
+        S[active], I[active] = cohort_step(cohorts, t[active], S[active], I[active], rng.binomial(S[active], prob),
+                                           rows=active)
+    return hit
+
+
+def splitting_probability(p, R, levels, statistic='peak', particles=1_000, N=200, contacts=4, rng=None):
+    """
+    estimates the probability of a rare event for stochastic_constant_contacts with multilevel splitting
+    the event is that statistic ('peak' or 'duration') is at least levels[-1]; the increasing intermediate levels
+        split it into conditional events that are not rare: particles are run from the start until they reach
+        levels[0] or their pandemic ends, then the states that reached it are cloned (resampled with replacement)
+        into particles new particles, which are run until levels[1], and so on
+    the estimate is the product of the fractions of particles reaching each level; its standard deviation is
+        estimated as estimate*sqrt(sum((1-f)/(particles*f))) over the fractions f, treating the stages as independent
+    returns a dictionary with the 'estimate', its 'std' and the 'fractions' reaching each level
+    """
+    if statistic not in ('peak', 'duration'):
+        raise ValueError("unknown statistic '{}'".format(statistic))
+    rng = make_rng(rng)
+    S = np.full(particles, N - 1, dtype=np.int64)
+    I = np.ones(particles, dtype=np.int64)
+    cohorts = np.zeros((particles, R+1), dtype=np.int64)
+    cohorts[:, 0] = 1 # first person gets infected before simulation starts
+    t = np.zeros(particles, dtype=np.int64)
+    fractions = []
+    for level in levels:
+        hit = _splitting_stage(S, I, cohorts, t, p, R, N, contacts, level, statistic, rng)
+        fractions.append(hit.mean())
+        if not hit.any():
+            break
+        clones = rng.choice(np.flatnonzero(hit), size=particles) # resample the states that reached the level
+        S, I, cohorts, t = S[clones], I[clones], cohorts[clones], t[clones]
+    fractions = np.array(fractions)
+    estimate = np.prod(fractions)
+    if estimate == 0:
+        return {'estimate': 0.0, 'std': 0.0, 'fractions': fractions}
+    std = estimate*np.sqrt(np.sum((1 - fractions)/(particles*fractions)))
+    return {'estimate': estimate, 'std': std, 'fractions': fractions}
@@ -15,6 +15,26 @@ def f(t, SIR, c):
             c[0] * SIR[0] * SIR[1] - c[1] * SIR[1], # I dot 
             c[1] * SIR[1]] #R dot
     return dSIRdt
+
+#Integrate until the infected fall below a threshold
+def solve_until_below(SIR, c, t0, t1, threshold):
+    '''
+    Integrates f from t0 to t1, stopping at the first time the infected fraction drops below threshold
+    This is used by the hybrid simulations, which only run the ODE while the outbreak is large.
+    Inputs: SIR (1x3 vector of fractions at t0), c (1x2 vector [b, k]), integer times t0 and t1,
+            threshold (fraction of infected at which to stop)
+    Outputs: integer times from t0 up to the stop, the 1x3 solution at each of them,
+             and whether the integration stopped because the threshold was crossed
+    Raises a RuntimeError if the integration fails (e.g. for infinite rates)
+    '''
+    def below(t, SIR, c):
+        return SIR[1] - threshold
+    below.terminal = True
+    below.direction = -1
+    sol = solve_ivp(f, (t0, t1), SIR, args=(c,), t_eval=np.arange(t0, t1 + 1), events=below, rtol=1e-6, atol=1e-9)
+    if not sol.success:
+        raise RuntimeError("ODE integration failed: {}".format(sol.message))
+    return sol.t.round().astype(int), sol.y.T, sol.status == 1
     
 #Event Interpolation Results
 def EventPrints(sol):
@@ -0,0 +1,98 @@
+"""
+This document contains the population container shared by the agent-based models.
+"""
+
+import numpy as np
+
+# integer codes used to store the state of each agent
+SUSC = 0
+INF = 1
+REC = 2
+
+
+class Population():
+    """
+    This class represents a population of N agents.
+    Instead of one Agent object per person, the states of all agents are stored in a single uint8 numpy array,
+    and running tallies of S, I and R are updated on every transition, so counting the population is O(1).
+    Assume that all agents are susceptible and no one is infected or recovered in the beginning.
+    """
+
+    def __init__(self, N):
+        self.N = N
+        self.state = np.full(N, SUSC, dtype=np.uint8)
+        self.counts = [N, 0, 0] # number of S, I and R people
+
+    def __len__(self):
+        return self.N
+
+    def change_state(self, i):
+        """
+        Changes state of agent i from S to I, or I to R
+        """
+        s = self.state[i]
+        if s != REC:
+            self.state[i] = s + 1
+            self.counts[s] -= 1
+            self.counts[s + 1] += 1
+
+    def infect(self, idx):
+        """
+        Changes state from S to I for all agents in idx
+        idx must only contain distinct susceptible agents
+        """
+        self.state[idx] = INF
+        n = np.size(idx)
+        self.counts[SUSC] -= n
+        self.counts[INF] += n
+
+    def recover(self, idx):
+        """
+        Changes state from I to R for all agents in idx
+        idx must only contain distinct infected agents
+        """
+        self.state[idx] = REC
+        n = np.size(idx)
+        self.counts[INF] -= n
+        self.counts[REC] += n
+
+    def tally(self, new_inf, new_rec):
+        """
+        Updates the tallies after new_inf infections and new_rec recoveries were made directly on the state array
+        """
+        self.counts[SUSC] -= new_inf
+        self.counts[INF] += new_inf - new_rec
+        self.counts[REC] += new_rec
+
+    def count_susc(self):
+        """
+        Returns # of susceptible people
+        """
+        return self.counts[SUSC]
+
+    def count_infected(self):
+        """
+        Returns # of infected people
+        """
+        return self.counts[INF]
+
+    def count_recovered(self):
+        """
+        Returns # of recovered people
+        """
+        return self.counts[REC]
+
+
+def census_chunks(records, size=1024):
+    """
+    Groups the census records yielded by one of the iter_* simulation generators into numpy arrays
+    Yields arrays of shape (size, number of fields per record); the last chunk may be shorter
+    """
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield np.array(chunk)
+            chunk = []
+    if chunk:
+        yield np.array(chunk)
@@ -0,0 +1,40 @@
+"""
+This document contains helpers to create the random number generators used by the simulations.
+Every simulation function takes an rng argument, which can be None (fresh entropy), an int seed,
+a numpy SeedSequence or a numpy Generator.
+"""
+
+import numpy as np
+from numpy.random import SeedSequence, default_rng
+
+
+def make_rng(rng=None):
+    """
+    Returns a numpy Generator from rng
+    A Generator is returned as is, so that consecutive calls share its stream
+    """
+    return default_rng(rng)
+
+
+def spawn_rngs(seed, n):
+    """
+    Returns a list of n independent Generators spawned from seed with numpy's SeedSequence
+    The i-th stream only depends on seed and i, so results do not depend on how the work is split between processes
+    seed can be None, an int, a SeedSequence or a Generator (whose stream then seeds the SeedSequence)
+    """
+    if isinstance(seed, np.random.Generator):
+        seed = seed.integers(2**63, size=4) # entropy drawn from the parent stream
+    if not isinstance(seed, SeedSequence):
+        seed = SeedSequence(seed)
+    return [default_rng(child) for child in seed.spawn(n)]
+
+
+def child_rng(rng):
+    """
+    Returns a Generator whose stream is independent of the one of the Generator rng, without drawing from rng:
+    unlike spawn_rngs, it spawns a child of the SeedSequence of rng, so rng gives the same numbers afterwards
+    (as Generator.spawn, which needs numpy 1.25 or later)
+    """
+    bit_generator = rng.bit_generator
+    seed_seq = getattr(bit_generator, 'seed_seq', None) or bit_generator._seed_seq # public from numpy 1.25 on
+    return default_rng(seed_seq.spawn(1)[0])
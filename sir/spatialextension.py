@@ -1,16 +1,16 @@
 from networkx.generators.community import stochastic_block_model as sbm
 import networkx as nx
 import numpy as np
-import random
 import sys
 sys.path.append("../")
+from sir.rng import make_rng
 
 
 class SpatialSparse:
 
-    def gen_graph(self, ks, ps):
+    def gen_graph(self, ks, ps, seed=None):
         """
-        Takes list of k clusters and list of lists probabilities ps
+        Takes list of k clusters and list of lists probabilities ps (and an optional integer seed for the graph)
         and generates:
             SBM graph G
             Measure Matrix
@@ -19,7 +19,7 @@ class SpatialSparse:
         self.ps = ps
 
         # Generate graph G and corresponding adjacency matrix
-        self.G = sbm(ks, ps)
+        self.G = sbm(ks, ps, seed=seed)
         Adj = nx.linalg.adj_matrix(self.G).todense()
 
         # Create a weight/distance matrix
@@ -61,7 +61,7 @@ class SpatialSparse:
         return laplace
 
 
-def simulation(ks, ps, beta, gamma, iters, pop_dist=None, inf_dist=None, inf_rate=0.02):
+def simulation(ks, ps, beta, gamma, iters, pop_dist=None, inf_dist=None, inf_rate=0.02, rng=None):
     """
     Input:
     - ks and ps to generate SBM
@@ -70,12 +70,14 @@ def simulation(ks, ps, beta, gamma, iters, pop_dist=None, inf_dist=None, inf_rat
     - pop_dist and inf_dist to specify the population and infection distribution, which is otherwise
         generated randomly as a function of k
     - inf_rate to specify the number of people initially infected in each infected region
+    - rng, the random number generator or a seed for one (see sir.rng), used for the graph and the initial conditions
     Returns:
         List of lists with each community's S, I and R
     """
     # Generate a model object and the corresponding graph
+    rng = make_rng(rng)
     model = SpatialSparse()
-    model.gen_graph(ks, ps)
+    model.gen_graph(ks, ps, seed=int(rng.integers(2**32)))
     n = sum(ks)
 
     # Generate the population (each element is a normalized population, where pop_i in [0, 1] and sum(pop) = 1
@@ -83,7 +85,7 @@ def simulation(ks, ps, beta, gamma, iters, pop_dist=None, inf_dist=None, inf_rat
         pop = np.empty(n)
         sum_pop = 0
         for i in range(n):
-            pop[i] = random.randint(1, n)
+            pop[i] = rng.integers(1, n + 1)
             sum_pop += pop[i]
         pop = pop*(1/sum_pop)
     else:
@@ -96,7 +98,7 @@ def simulation(ks, ps, beta, gamma, iters, pop_dist=None, inf_dist=None, inf_rat
     # Generate a random infected population, ie. randomly choose communities:
     if inf_dist is None:
         for i in range(n):
-            if 3/n > np.random.rand(): # Chosen to infect at least one population (unless we are v unlucky)
+            if 3/n > rng.random(): # Chosen to infect at least one population (unless we are v unlucky)
                 I[i] += inf_rate*S[i] # Infect 2%, can play with either 0.1 or 0.02 as hyperparameter
                 S[i] -= inf_rate*S[i]
 
@@ -2,8 +2,11 @@
 This document contains the code for setting up the stochastic SIR model. 
 """
 
-from numpy.random import randint, rand
 import numpy as np 
+from scipy.special import lambertw
+from sir.population import Population, SUSC, INF, REC
+from sir.rng import make_rng, child_rng
+from sir.kernels import select_backend, seed_kernels, stochastic_step
 
 # note: the class below is the same as the one used in the basic discrete model. We pasted it here for convenience.
 class Agent():
@@ -34,10 +37,13 @@ class Agent():
             pass
 
 # functions to count the number of infected, recovered and susceptible at a given point in time
+# pop is either a list of Agent objects or a Population, which keeps running tallies
 def count_susc(pop):
     """
     Returns # of susceptible people
     """
+    if isinstance(pop, Population):
+        return pop.count_susc()
     return sum(p.state == 'S' for p in pop)
 
 
@@ -45,6 +51,8 @@ def count_infected(pop):
     """
     Returns # of infected people
     """
+    if isinstance(pop, Population):
+        return pop.count_infected()
     return sum(p.state == 'I' for p in pop)
 
 
@@ -52,88 +60,426 @@ def count_recovered(pop):
     """
     Returns # of recovered people
     """
+    if isinstance(pop, Population):
+        return pop.count_recovered()
     return sum(p.state == 'R' for p in pop)
 
 
 # Simulations to calculate the trajectories of S, I and R people
-# First set of simulations: constant number of contacts per person
-def stochastic_constant_contacts(p, R, N=200, contacts=4):
+# Each model is written as a generator, iter_stochastic_*, which yields the census (S, I, R, t) after every time period,
+# so long runs can be streamed or stopped early; stochastic_* collect the whole trajectory in lists
+# every simulation takes rng, a numpy Generator or a seed for one (see sir.rng)
+# and backend: 'python' (loop over agents), 'numba' (compiled loop, see sir.kernels), 'numpy' (vectorized step)
+# or 'cohort' (count-level engine, see iter_stochastic_cohort)
+BACKENDS = ('python', 'numba', 'numpy', 'cohort')
+
+
+def collect_trajectory(records):
     """
-    runs simulation of the stochastic SIR model with constant number of contacts
-    p is the probability of transmission
-    R is the period for which individual remains infected
-    N is the population size
-    contacts is the number of contacts per time period per person
+    collects the census records (S, I, R, t) yielded by one of the iter_stochastic_* generators
     returns the trajectory of S, I and R people and the duration of the pandemic
     """
-    pop = [Agent() for i in range(N)] # create the population
-    pop[0].change_state()
     counts_sus = []
     counts_inf = []
     counts_rec = []
-    t_firstinf = np.empty(N) # initialize vector to store the time at which individual gets infected
-    t_firstinf[0] = 0 # first person gets infected before simulation starts
-    t=0
+    t = 0
+    for sus, inf, rec, t in records:
+        counts_sus.append(sus)
+        counts_inf.append(inf)
+        counts_rec.append(rec)
+    return counts_sus, counts_inf, counts_rec, t
+
+
+def _vectorized_step(pop, t_firstinf, contacts, p, R, inf, t, rng):
+    """
+    one time period of the stochastic models for all agents at once
+    contacts is the number of contacts per person, either one number or an array with one entry per agent
+    the infection probability only depends on inf, the number infected at the start of the period, and the recovery
+    on the time of infection, so this has the same distribution as the loop over agents
+    """
+    state = pop.state
+    sus = np.flatnonzero(state == SUSC)
+    rec = np.flatnonzero((state == INF) & (t_firstinf == t-R-1)) # time for these people to recover
+    contacts_num = contacts if np.ndim(contacts) == 0 else contacts[sus]
+    prob = 1 - (1-((p*inf)/(pop.N-1)))**contacts_num
+    new = sus[rng.random(sus.size) < prob]
+    pop.infect(new)
+    t_firstinf[new] = t
+    pop.recover(rec)
+
+
+def _log_step(log, t_firstinf, R, t, rng):
+    """
+    records the infections and recoveries of period t in log (a sir.transmission.InfectionLog), from the infection times
+    in the model a person is not infected by anyone in particular: every infected contact is equally likely,
+        so the infector of each new infection is drawn uniformly among the people infected at the start of the period
+    rng is a stream spawned for the log, separate from the one of the simulation
+    """
+    new = np.flatnonzero(t_firstinf == t)
+    if new.size > 0:
+        sources = np.flatnonzero((t_firstinf >= max(t-R-1, 0)) & (t_firstinf < t))
+        log.infect(new, t, sources[rng.integers(sources.size, size=new.size)])
+    if t-R-1 >= 0:
+        log.recover(np.flatnonzero(t_firstinf == t-R-1), t)
+
+
+def grouped_infections(s_levels, levels, p, inf, N, rng):
+    """
+    returns the number of new infections among s_levels[j] susceptibles with levels[j] contacts each, for every j
+    all people with the same number of contacts have the same infection probability, so the probability table
+    1 - (1-(p*inf)/(N-1))**c is computed once per period and one binomial is drawn per group: the cost depends on
+    the number of distinct contact levels, not on N
+    """
+    levels = np.asarray(levels)
+    table = 1 - (1-((p*inf)/(N-1)))**np.arange(levels.max(initial=0) + 1) # probability for every contact level
+    return rng.binomial(s_levels, table[levels])
+
+
+# Count-level engine: everyone recovers exactly R+1 periods after being infected, so the infected are
+# the last R+1 cohorts of new infections, which are kept in a ring buffer
+def cohort_step(cohorts, t, S, I, new_inf, rows=None):
+    """
+    moves the ring buffer of cohorts to time t: the new_inf people infected at t take the slot of the cohort
+        infected at t-R-1, who recover now
+    cohorts is one ring buffer of shape (R+1,), or one per run of shape (runs, R+1) of which only the given rows
+        are moved, with t, S, I and new_inf then having one entry per row
+    returns the new numbers of susceptible and infected people
+    """
+    slot = t % cohorts.shape[-1]
+    index = slot if rows is None else (rows, slot)
+    new_rec = cohorts[index]
+    cohorts[index] = new_inf
+    return S - new_inf, I + new_inf - new_rec
+
+
+def iter_stochastic_cohort(p, R, N=200, contacts=4, random=0, rng=None, handoff=None):
+    """
+    count-level version of the iter_stochastic_* generators
+    contacts is either the number of contacts of everyone, or an array whose entry c is the number of susceptibles
+        with c fixed contacts at the start (summing to N-1); random is the maximum random component added to
+        everyone's contacts every period, as in stochastic_random_contacts
+    the susceptibles are only tracked as counts per fixed contact level; each period they are split at random over
+        the random components and the new infections are drawn with grouped_infections
+    the people recovering are the cohort infected R+1 periods ago, which leaves the ring buffer
+    memory is O(R) and each period costs O(number of contact levels), independent of N
+    yields the number of S, I and R people and the time t after every time period, until the pandemic ends
+        or, if handoff is given, until at least handoff people are infected
+    returns the number of susceptibles, the ring buffer of cohorts and the time at which it stops
+    """
+    rng = make_rng(rng)
+    if np.ndim(contacts) == 0:
+        fixed_levels = np.array([contacts])
+        s_levels = np.array([N - 1])
+    else:
+        s_levels = np.asarray(contacts) # number of susceptibles with each fixed number of contacts
+        fixed_levels = np.arange(s_levels.size)
+    levels = fixed_levels[:, None] + np.arange(random+1)[None, :] # total contacts for every (fixed, random) pair
+    cohorts = np.zeros(R+1, dtype=np.int64) # cohorts[t % (R+1)] is the number of people infected at time t
+    cohorts[0] = 1 # first person gets infected before simulation starts
+    S = N - 1
+    I = 1
+    t = 0
+    while I > 0 and (handoff is None or I < handoff):
+        t = t + 1
+        if random > 0:
+            split = rng.multinomial(s_levels, np.full(random+1, 1/(random+1))) # random component of every susceptible
+        else:
+            split = s_levels[:, None]
+        new_inf = grouped_infections(split, levels, p, I, N, rng).sum(axis=1)
+        s_levels = s_levels - new_inf
+        S, I = cohort_step(cohorts, t, S, I, new_inf.sum())
+        yield int(S), int(I), int(N - S - I), t
+    return int(S), cohorts, t
+
+
+# Early phase: while few people are infected, the pandemic is close to a branching process in which every infected
+# person makes about p*contacts new infections per period for R+1 periods
+def extinction_probability(p, R, contacts=4):
+    """
+    returns the probability that the pandemic of stochastic_constant_contacts dies out early (a minor outbreak),
+        in the branching-process approximation for a large population
+    the number of people infected by one person is then Poisson with mean m = (R+1)*p*contacts, so the extinction
+        probability is the smallest solution of q = exp(m*(q-1)), which is q = -W(-m*exp(-m))/m (W the Lambert function)
+    """
+    m = (R+1)*p*contacts
+    if m <= 1:
+        return 1.0
+    return float(-lambertw(-m*np.exp(-m)).real/m)
+
+
+def _population_from_cohorts(N, S, cohorts, t, R, rng):
+    """
+    creates the agents at time t from the counts of the early phase: S susceptibles and the ring buffer of cohorts
+    all agents are exchangeable, so each cohort is given to distinct agents chosen at random, with the time at which
+        the cohort got infected, and the people infected before the last R+1 periods are recovered
+    returns the Population and the vector of infection times
+    """
+    pop = Population(N)
+    t_firstinf = np.full(N, -1, dtype=np.int32)
+    times = np.arange(max(t-R, 0), t+1) # the cohorts infected in the last R+1 periods
+    sizes = cohorts[times % (R+1)]
+    I = sizes.sum()
+    order = rng.permutation(N)
+    t_firstinf[order[:I]] = np.repeat(times, sizes)
+    pop.infect(order[:N-S]) # everyone who has been infected so far
+    pop.recover(order[I:N-S])
+    return pop, t_firstinf
+
+
+# Hybrid engine: the count-level model for small outbreaks and the mean-field ODE for large ones
+def iter_stochastic_hybrid(p, R, N=200, contacts=4, threshold=100, rng=None):
+    """
+    hybrid version of iter_stochastic_constant_contacts
+    while fewer than threshold people are infected the pandemic is run at the level of counts (as iter_stochastic_cohort);
+        once there are more, it is run with the mean-field ODE of sir.ode_function until the number of infected drops
+        below threshold again, then handed back to the count-level model for the end of the pandemic
+    the ODE has b_ode = contacts*p*N/(N-1) (the infection hazard of one susceptible is about contacts*p*I/(N-1))
+        and k_ode = 1/(R+1), the inverse of the time people stay infected
+    when switching back, everyone infected in the last R+1 periods of the ODE (the rounded drops in S) is infected,
+        so the cohorts that recover in the following periods are rebuilt from the incidence
+    recovery in the ODE is exponential rather than after exactly R+1 periods, so the final size matches the
+        stochastic model but large outbreaks have a lower, later peak and a longer tail
+    yields the number of S, I and R people and the time t after every time period, until the pandemic ends
+    """
+    from sir.ode_function import solve_until_below # only imported when needed, as it loads scipy.integrate and pyplot
+    rng = make_rng(rng)
+    c = [contacts*p*N/(N-1), 1/(R+1)] # ODE rates for fractions of the population
+    cohorts = np.zeros(R+1, dtype=np.int64) # cohorts[t % (R+1)] is the number of people infected at time t
+    cohorts[0] = 1 # first person gets infected before simulation starts
+    history = [N, N - 1] # history[t+1] is the number of susceptibles at time t, history[0] the one before patient zero
+    S = N - 1
+    I = 1
+    t = 0
+    while I > 0:
+        if I >= threshold:
+            crossed = False
+            while not crossed: # integrate in windows of 100 periods until the outbreak is small again
+                y0 = np.array([S, I, N - S - I])/N
+                ts, ys, crossed = solve_until_below(y0, c, t, t + 100, threshold/N)
+                for time, y in zip(ts[1:], ys[1:]):
+                    S, I = int(round(y[0]*N)), int(round(y[1]*N))
+                    history.append(S)
+                    yield S, I, N - S - I, int(time)
+                t = int(ts[-1])
+            cohorts = np.zeros(R+1, dtype=np.int64)
+            for time in range(max(t-R, 0), t+1):
+                cohorts[time % (R+1)] = history[time] - history[time+1]
+            I = int(cohorts.sum())
+        # one stochastic step, which also moves on from the last ODE state when the threshold was crossed
+        t = t + 1
+        S, I = cohort_step(cohorts, t, S, I, grouped_infections(S, contacts, p, I, N, rng))
+        history.append(S)
+        yield int(S), int(I), int(N - S - I), t
+
+
+def stochastic_constant_contacts_hybrid(p, R, N=200, contacts=4, threshold=100, rng=None):
+    """
+    runs simulation of the stochastic SIR model with constant number of contacts, switching to the mean-field ODE
+        while at least threshold people are infected (see iter_stochastic_hybrid)
+    a large outbreak then costs about one ODE solve plus the stochastic early and late phases, whatever N is
+    returns the trajectory of S, I and R people and the duration of the pandemic
+    """
+    return collect_trajectory(iter_stochastic_hybrid(p, R, N=N, contacts=contacts, threshold=threshold, rng=rng))
+
+
+# First set of simulations: constant number of contacts per person
+def iter_stochastic_constant_contacts(p, R, N=200, contacts=4, rng=None, backend='python', handoff=None, log=None):
+    """
+    generator version of stochastic_constant_contacts
+    yields the number of S, I and R people and the time t after every time period, until the pandemic ends
+    """
+    rng = make_rng(rng)
+    backend = select_backend(backend, BACKENDS)
+    if log is not None and (backend == 'cohort' or handoff is not None):
+        raise ValueError("log needs the agents, so it cannot be used with backend='cohort' or handoff")
+    if backend == 'cohort' and handoff is not None:
+        raise ValueError("handoff switches from counts to agents, so it cannot be used with backend='cohort'")
+    if backend == 'cohort':
+        yield from iter_stochastic_cohort(p, R, N=N, contacts=contacts, rng=rng)
+        return
+    if backend == 'numba':
+        seed_kernels(rng.integers(2**32))
+    if handoff is None:
+        pop = Population(N) # create the population
+        pop.change_state(0)
+        t_firstinf = np.full(N, -1, dtype=np.int32) # initialize vector to store the time at which individual gets infected
+        t_firstinf[0] = 0 # first person gets infected before simulation starts
+        if log is not None:
+            log.infect(0, 0)
+            log_rng = child_rng(rng) # the infectors have their own stream, so logging does not change the run
+        t=0
+    else:
+        S, cohorts, t = yield from iter_stochastic_cohort(p, R, N=N, contacts=contacts, rng=rng, handoff=handoff)
+        if cohorts.sum() == 0: # the pandemic died out before the agents were needed
+            return
+        pop, t_firstinf = _population_from_cohorts(N, S, cohorts, t, R, rng)
+    state = pop.state
+    contact_array = np.full(N, contacts) # contacts of every person, for the compiled kernel
     while count_infected(pop)>0: # run until pandemic ends (there are no infected people)
         t = t + 1
         inf = count_infected(pop) 
-        for i in range(N):
-            if pop[i].state == 'S':
-                contacts_num = contacts
-                prob = 1 - (1-((p*inf)/(N-1)))**contacts_num  # per the formula given in the paper    
-                if rand() < prob:
-                    pop[i].change_state() # infect the S person
-                    t_firstinf[i] = t # store the time at which he gets infected
-            if pop[i].state == 'I':
-                if t_firstinf[i] == t-R-1: # time for person i to recover
-                    pop[i].change_state() # recover the person
-        counts_sus.append(count_susc(pop)) # update the counts
-        counts_inf.append(count_infected(pop))
-        counts_rec.append(count_recovered(pop))
-    return counts_sus, counts_inf, counts_rec, t
+        if backend == 'numba':
+            pop.tally(*stochastic_step(state, t_firstinf, contact_array, p, R, inf, t))
+        elif backend == 'numpy':
+            _vectorized_step(pop, t_firstinf, contacts, p, R, inf, t, rng)
+        else:
+            for i in range(N):
+                if state[i] == SUSC:
+                    contacts_num = contacts
+                    prob = 1 - (1-((p*inf)/(N-1)))**contacts_num  # per the formula given in the paper    
+                    if rng.random() < prob:
+                        pop.change_state(i) # infect the S person
+                        t_firstinf[i] = t # store the time at which he gets infected
+                if state[i] == INF:
+                    if t_firstinf[i] == t-R-1: # time for person i to recover
+                        pop.change_state(i) # recover the person
+        if log is not None:
+            _log_step(log, t_firstinf, R, t, log_rng)
+        yield count_susc(pop), count_infected(pop), count_recovered(pop), t # report the counts
+
+
+def stochastic_constant_contacts(p, R, N=200, contacts=4, rng=None, backend='python', handoff=None, log=None):
+    """
+    runs simulation of the stochastic SIR model with constant number of contacts
+    p is the probability of transmission
+    R is the period for which individual remains infected
+    N is the population size
+    contacts is the number of contacts per time period per person
+    rng is the random number generator, or a seed for one
+    backend is 'python', 'numba' to run the update loop as a compiled kernel ('auto' uses numba when installed)
+        or 'numpy' to update all agents with one vectorized expression, which scales to N = 10^6
+        or 'cohort' to only track counts (see iter_stochastic_cohort), at a cost independent of N
+    handoff, if given, runs the pandemic at the level of counts while fewer than handoff people are infected and only
+        creates the agents once it passes, so minor outbreaks (see extinction_probability) never allocate the population;
+        the agents are exchangeable, so the trajectory has the same distribution as without handoff
+    log is an optional sir.transmission.InfectionLog of size N, filled with the infection history of the agents
+        (not available with backend='cohort' or handoff, which do not track agents)
+    returns the trajectory of S, I and R people and the duration of the pandemic
+    """
+    return collect_trajectory(iter_stochastic_constant_contacts(p, R, N=N, contacts=contacts, rng=rng, backend=backend,
+                                                                handoff=handoff, log=log))
 
     
 # Second set of simulations: fixed number of contacts over time, but randomly chosen for each individual
-def stochastic_fixed_contacts(p, R, N=200, fixed=10):
+def iter_stochastic_fixed_contacts(p, R, N=200, fixed=10, rng=None, backend='python', log=None):
+    """
+    generator version of stochastic_fixed_contacts
+    yields the number of S, I and R people and the time t after every time period, until the pandemic ends
+    """
+    rng = make_rng(rng)
+    backend = select_backend(backend, BACKENDS)
+    if log is not None and backend == 'cohort':
+        raise ValueError("log needs the agents, so it cannot be used with backend='cohort'")
+    if backend == 'cohort':
+        s_levels = rng.multinomial(N-1, np.full(fixed+1, 1/(fixed+1))) # susceptibles per fixed number of contacts
+        yield from iter_stochastic_cohort(p, R, N=N, contacts=s_levels, rng=rng)
+        return
+    if backend == 'numba':
+        seed_kernels(rng.integers(2**32))
+    pop = Population(N)
+    pop.change_state(0)
+    state = pop.state
+    t_firstinf = np.full(N, -1, dtype=np.int32)
+    t_firstinf[0] = 0
+    if log is not None:
+        log.infect(0, 0)
+        log_rng = child_rng(rng) # the infectors have their own stream, so logging does not change the run
+    t=0
+    nums = fixed + 1
+    contact_list = rng.integers(nums, size=N) # fixed number of contacts over time generated at random
+    while count_infected(pop)>0:
+        t = t + 1
+        inf = count_infected(pop)
+        if backend == 'numba':
+            pop.tally(*stochastic_step(state, t_firstinf, contact_list, p, R, inf, t))
+        elif backend == 'numpy':
+            _vectorized_step(pop, t_firstinf, contact_list, p, R, inf, t, rng)
+        else:
+            for i in range(N):
+                if state[i] == SUSC:
+                    contacts = contact_list[i]
+                    prob = 1 - (1-((p*inf)/(N-1)))**contacts        
+                    if rng.random() < prob:
+                        pop.change_state(i)
+                        t_firstinf[i] = t
+                if state[i] == INF:
+                    if t_firstinf[i] == t-R-1:
+                        pop.change_state(i)
+        if log is not None:
+            _log_step(log, t_firstinf, R, t, log_rng)
+        yield count_susc(pop), count_infected(pop), count_recovered(pop), t
+
+
+def stochastic_fixed_contacts(p, R, N=200, fixed=10, rng=None, backend='python', log=None):
     """
     runs simulation of the stochastic SIR model with fixed number of contacts over time generated at random at the beginning of the simulation
     p is the probability of transmission
     R is the period for which individual remains infected
     N is the population size
     fixed is the maximum number of contacts per time period per person:
-        the generation of contacts is done through np.random.randint(fixed, size=N) before the start of the simulation
+        the generation of contacts is done through rng.integers(fixed+1, size=N) before the start of the simulation
+    rng is the random number generator, or a seed for one
+    backend is 'python', 'numba' to run the update loop as a compiled kernel ('auto' uses numba when installed)
+        or 'numpy' to update all agents with one vectorized expression, which scales to N = 10^6
+        or 'cohort' to only track counts per contact level (see iter_stochastic_cohort), at a cost independent of N
+    log is an optional sir.transmission.InfectionLog of size N, filled with the infection history (not with 'cohort')
     returns the trajectory of S, I and R people and the duration of the pandemic
     """
-    pop = [Agent() for i in range(N)]
-    pop[0].change_state()
-    counts_sus = []
-    counts_inf = []
-    counts_rec = []
-    t_firstinf = np.empty(N)
+    return collect_trajectory(iter_stochastic_fixed_contacts(p, R, N=N, fixed=fixed, rng=rng, backend=backend, log=log))
+
+
+# Third set of simulations: contacts = fixed component plus random component
+def iter_stochastic_random_contacts(p, R, N=200, fixed=10, random=4, rng=None, backend='python', log=None):
+    """
+    generator version of stochastic_random_contacts
+    yields the number of S, I and R people and the time t after every time period, until the pandemic ends
+    """
+    rng = make_rng(rng)
+    backend = select_backend(backend, BACKENDS)
+    if log is not None and backend == 'cohort':
+        raise ValueError("log needs the agents, so it cannot be used with backend='cohort'")
+    if backend == 'cohort':
+        s_levels = rng.multinomial(N-1, np.full(fixed+1, 1/(fixed+1))) # susceptibles per fixed number of contacts
+        yield from iter_stochastic_cohort(p, R, N=N, contacts=s_levels, random=random, rng=rng)
+        return
+    if backend == 'numba':
+        seed_kernels(rng.integers(2**32))
+    pop = Population(N)
+    pop.change_state(0)
+    state = pop.state
+    t_firstinf = np.full(N, -1, dtype=np.int32)
     t_firstinf[0] = 0
+    if log is not None:
+        log.infect(0, 0)
+        log_rng = child_rng(rng) # the infectors have their own stream, so logging does not change the run
     t=0
-    nums = fixed + 1
-    contact_list = np.random.randint(nums, size=N) # fixed number of contacts over time generated at random
+    fixed_list = rng.integers(fixed+1, size=N) # fixed number of contacts over time generated at random
     while count_infected(pop)>0:
         t = t + 1
+        var = rng.integers(random+1, size=N) # random component of contacts that changes every time period
+        contacts = fixed_list + var # contacts per person is fixed plus random
         inf = count_infected(pop)
-        for i in range(N):
-            if pop[i].state == 'S':
-                contacts = contact_list[i]
-                prob = 1 - (1-((p*inf)/(N-1)))**contacts        
-                if rand() < prob:
-                    pop[i].change_state()
-                    t_firstinf[i] = t
-            if pop[i].state == 'I':
-                if t_firstinf[i] == t-R-1:
-                    pop[i].change_state()
-        counts_sus.append(count_susc(pop))
-        counts_inf.append(count_infected(pop))
-        counts_rec.append(count_recovered(pop))
-    return counts_sus, counts_inf, counts_rec, t
+        if backend == 'numba':
+            pop.tally(*stochastic_step(state, t_firstinf, contacts, p, R, inf, t))
+        elif backend == 'numpy':
+            _vectorized_step(pop, t_firstinf, contacts, p, R, inf, t, rng)
+        else:
+            for i in range(N):
+                if state[i] == SUSC:
+                    contacts_num = contacts[i]
+                    prob = 1 - (1-((p*inf)/(N-1)))**contacts_num        
+                    if rng.random() < prob:
+                        pop.change_state(i)
+                        t_firstinf[i] = t
+                if state[i] == INF:
+                    if t_firstinf[i] == t-R-1:
+                        pop.change_state(i)
+        if log is not None:
+            _log_step(log, t_firstinf, R, t, log_rng)
+        yield count_susc(pop), count_infected(pop), count_recovered(pop), t
 
-# Third set of simulations: contacts = fixed component plus random component
-def stochastic_random_contacts(p, R, N=200, fixed=10, random=4):
+
+def stochastic_random_contacts(p, R, N=200, fixed=10, random=4, rng=None, backend='python', log=None):
     """
     runs simulation of the stochastic SIR model with contacts having a fixed component over time plus a random component that varies over time
     p is the probability of transmission
@@ -141,41 +487,83 @@ def stochastic_random_contacts(p, R, N=200, fixed=10, random=4):
     N is the population size
     fixed is the maximum number of contacts per time period per person:
         pertains to the fixed component
-        the generation of contacts is done through np.random.randint(fixed, size=N) before the start of the simulation
+        the generation of contacts is done through rng.integers(fixed+1, size=N) before the start of the simulation
     random is the maximum number of contacts per time period per person:
         pertains to the random component
-        for every time period, the function runs np.random.randint(random, size=N)
+        for every time period, the function runs rng.integers(random+1, size=N)
+    rng is the random number generator, or a seed for one
+    backend is 'python', 'numba' to run the update loop as a compiled kernel ('auto' uses numba when installed)
+        or 'numpy' to update all agents with one vectorized expression, which scales to N = 10^6
+        or 'cohort' to only track counts per contact level (see iter_stochastic_cohort), at a cost independent of N
+    log is an optional sir.transmission.InfectionLog of size N, filled with the infection history (not with 'cohort')
     returns the trajectory of S, I and R people and the duration of the pandemic
     """
-    pop = [Agent() for i in range(N)]
-    pop[0].change_state()
-    counts_sus = []
-    counts_inf = []
-    counts_rec = []
-    t_firstinf = np.empty(N)
-    t_firstinf[0] = 0
-    t=0
-    fixed_list = np.random.randint(fixed+1, size=N) # fixed number of contacts over time generated at random
-    while count_infected(pop)>0:
-        t = t + 1
-        var = np.random.randint(random+1, size=N) # random component of contacts that changes every time period
-        contacts = fixed_list + var # contacts per person is fixed plus random
-        inf = count_infected(pop)
-        for i in range(N):
-            if pop[i].state == 'S':
-                contacts_num = contacts[i]
-                prob = 1 - (1-((p*inf)/(N-1)))**contacts_num        
-                if rand() < prob:
-                    pop[i].change_state()
-                    t_firstinf[i] = t
-            if pop[i].state == 'I':
-                if t_firstinf[i] == t-R-1:
-                    pop[i].change_state()
-        counts_sus.append(count_susc(pop))
-        counts_inf.append(count_infected(pop))
-        counts_rec.append(count_recovered(pop))
-    return counts_sus, counts_inf, counts_rec, t
+    return collect_trajectory(iter_stochastic_random_contacts(p, R, N=N, fixed=fixed, random=random, rng=rng,
+                                                              backend=backend, log=log))
 
 
+# Ensembles: many trials of stochastic_constant_contacts advanced together
+def ensemble_summaries(p, R, trials=500, N=200, contacts=4, counts_only=True, rng=None):
+    """
+    runs trials independent simulations of stochastic_constant_contacts at once
+    by default each trial is a ring buffer of its last R+1 infection cohorts (as in iter_stochastic_cohort),
+        so the state of the ensemble is a (trials, R+1) array; counts_only=False keeps a (trials, N) state matrix
+        and a (trials, N) matrix of infection times instead
+    trials where the pandemic has ended are masked out, so each period only costs work for the trials still running
+    returns a dictionary of arrays with one entry per trial:
+        'peak' (max of the infected counts), 'peak_time' (first t at which the peak is reached),
+        'duration' (the t returned by stochastic_constant_contacts) and 'final_size' (number of people ever infected)
+    """
+    rng = make_rng(rng)
+    peaks = np.zeros(trials, dtype=np.int64)
+    peak_times = np.zeros(trials, dtype=np.int64)
+    durations = np.zeros(trials, dtype=np.int64)
+    if counts_only:
+        S = np.full(trials, N - 1, dtype=np.int64)
+        I = np.ones(trials, dtype=np.int64)
+        cohorts = np.zeros((trials, R+1), dtype=np.int64)
+        cohorts[:, 0] = 1 # first person gets infected before simulation starts
+    else:
+        state = np.full((trials, N), SUSC, dtype=np.uint8)
+        state[:, 0] = INF
+        t_firstinf = np.full((trials, N), -1, dtype=np.int32)
+        t_firstinf[:, 0] = 0
+        S = np.full(trials, N - 1, dtype=np.int64)
+        I = np.ones(trials, dtype=np.int64)
+    active = np.arange(trials) # trials where the pandemic is still going on
+    t = 0
+    while active.size > 0:
+        t = t + 1
+        prob = 1 - (1-((p*I[active])/(N-1)))**contacts # infection probability in every running trial
+        if counts_only:
+            S[active], I[active] = cohort_step(cohorts, t, S[active], I[active], rng.binomial(S[active], prob),
+                                               rows=active)
+        else:
+            sub = state[active]
+            first = t_firstinf[active]
+            rec = (sub == INF) & (first == t-R-1)
+            new = (sub == SUSC) & (rng.random(sub.shape) < prob[:, None])
+            sub[new] = INF
+            first[new] = t
+            sub[rec] = REC
+            state[active] = sub
+            t_firstinf[active] = first
+            new_inf = new.sum(axis=1)
+            S[active] -= new_inf
+            I[active] += new_inf - rec.sum(axis=1)
+        higher = active[I[active] > peaks[active]]
+        peaks[higher] = I[higher]
+        peak_times[higher] = t
+        durations[active] = t
+        active = active[I[active] > 0]
+    return {'peak': peaks, 'peak_time': peak_times, 'duration': durations, 'final_size': N - S}
 
 
+def stochastic_ensemble(p, R, trials=500, N=200, contacts=4, counts_only=True, rng=None):
+    """
+    runs trials independent simulations of stochastic_constant_contacts at once (see ensemble_summaries)
+    returns two arrays with one entry per trial: the peak of the pandemic (max of the infected counts)
+        and its duration (the t returned by stochastic_constant_contacts)
+    """
+    summaries = ensemble_summaries(p, R, trials=trials, N=N, contacts=contacts, counts_only=counts_only, rng=rng)
+    return summaries['peak'], summaries['duration']
@@ -0,0 +1,92 @@
+"""
+This document contains the per-agent infection log filled by the agent models, and functions to analyze it.
+The log is three int32 arrays with one entry per agent, using -1 for "never" or "unknown":
+the time of infection, the time of recovery and the agent who caused the infection.
+Together they form the transmission tree of a run, and everything below is computed from them with numpy.
+"""
+
+import numpy as np
+
+
+class InfectionLog():
+    """
+    This class represents the infection history of a population of N agents.
+    Pass it as the log argument of run_simulation, discrete_spatial_simulation or one of the stochastic_* functions,
+    which fill in t_inf, t_rec and infector while they run.
+    """
+
+    def __init__(self, N):
+        self.N = N
+        self.t_inf = np.full(N, -1, dtype=np.int32) # time at which each agent got infected
+        self.t_rec = np.full(N, -1, dtype=np.int32) # time at which each agent recovered
+        self.infector = np.full(N, -1, dtype=np.int32) # agent who infected each agent (-1 for the initial infected)
+
+    def __len__(self):
+        return self.N
+
+    def infect(self, idx, t, infector=-1):
+        """
+        Records the infection of the agents in idx at time t by infector (one agent, or one per agent in idx)
+        """
+        self.t_inf[idx] = t
+        self.infector[idx] = infector
+
+    def recover(self, idx, t):
+        """
+        Records the recovery of the agents in idx at time t
+        """
+        self.t_rec[idx] = t
+
+
+def log_arrays(log):
+    """
+    Returns the arrays (t_inf, t_rec, infector) of log, for the compiled kernels of sir.kernels
+    When log is None, returns empty arrays, which the kernels take to mean that nothing is recorded
+    """
+    if log is None:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty, empty
+    return log.t_inf, log.t_rec, log.infector
+
+
+def offspring_counts(log):
+    """
+    Returns the number of people infected by each agent
+    """
+    infector = log.infector
+    return np.bincount(infector[infector >= 0], minlength=len(log))
+
+
+def offspring_distribution(log, recovered_only=True):
+    """
+    Returns how many infected agents infected 0, 1, 2, ... people
+    By default only the agents who have recovered are counted, since the others could still infect people
+    """
+    counts = offspring_counts(log)
+    mask = log.t_rec >= 0 if recovered_only else log.t_inf >= 0
+    return np.bincount(counts[mask])
+
+
+def generation_intervals(log):
+    """
+    Returns the time between the infection of each agent with a known infector and the infection of its infector
+    """
+    child = np.flatnonzero(log.infector >= 0)
+    return log.t_inf[child] - log.t_inf[log.infector[child]]
+
+
+def reproduction_number(log, T=None):
+    """
+    Returns R_t for t = 0, ..., T: the mean number of people infected by the agents who got infected at time t
+    (nan for times without new infections); T defaults to the time of the last infection
+    People infected near the end of a run that was stopped before the pandemic ended can still infect others,
+    so the last values are biased down in that case
+    """
+    infected = np.flatnonzero(log.t_inf >= 0)
+    if T is None:
+        T = log.t_inf.max(initial=0)
+    times = log.t_inf[infected]
+    cases = np.bincount(times, minlength=T+1)[:T+1]
+    offspring = np.bincount(times, weights=offspring_counts(log)[infected], minlength=T+1)[:T+1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return offspring/cases
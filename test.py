@@ -13,6 +13,12 @@ from sir.ode_function_spatial import *
 from sir.discretemodel import *
 from sir.discretemodelspatial import *
 from sir.stochasticsir import *
+from sir.population import *
+from sir.rng import *
+from sir.kernels import *
+from sir.montecarlo import *
+from sir.gillespie import *
+from sir.transmission import *
 
 ###########################################################Basic ODE Model########################################################################################
 class TestODEs(unittest.TestCase):
@@ -194,6 +200,119 @@ class TestDiscreteMethod(unittest.TestCase):
                         for i in range(len(counts_sus)):
                             cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
                             self.assertEqual(cts, n)
+
+    def test_sum_array(self):
+        """
+        Tests that S+I+R = N for the array-backed engine in both update orders
+        """
+        for sequential in [False, True]:
+            for n in [10, 20, 30]:
+                counts_sus, counts_inf, counts_rec = run_simulation_array(0.1, 0.05, N=n, T=20, sequential=sequential)
+                self.assertEqual(len(counts_sus), 21)
+                for i in range(len(counts_sus)):
+                    cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
+                    self.assertEqual(cts, n)
+
+    def test_sum_binomial(self):
+        """
+        Tests that S+I+R = N for the chain binomial engine, also for a very large population
+        """
+        for n in [10, 1_000, 10**8]:
+            counts_sus, counts_inf, counts_rec = run_simulation_binomial(0.1, 0.05, N=n, T=20)
+            self.assertEqual(len(counts_sus), 21)
+            for i in range(len(counts_sus)):
+                cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
+                self.assertEqual(cts, n)
+            self.assertTrue(0 <= run_simulation_phase_binomial(0.1, 0.05, N=n, T=10) <= n)
+
+    def test_ensemble(self):
+        """
+        Tests the shape of the ensemble output and that S+I+R = N for every replicate
+        """
+        for counts_only in [False, True]:
+            counts_sus, counts_inf, counts_rec = run_ensemble(0.01, 0.05, N=50, T=20, replicates=30, counts_only=counts_only)
+            self.assertEqual(counts_sus.shape, (30, 21))
+            self.assertTrue(np.all(counts_sus + counts_inf + counts_rec == 50))
+            self.assertEqual(ensemble_mean(counts_inf).shape, (21,))
+            bands = ensemble_quantiles(counts_inf)
+            self.assertEqual(bands.shape, (3, 21))
+            self.assertTrue(np.all(bands[0] <= bands[2]))
+
+    def test_phase_diagram(self):
+        """
+        Tests the shape and range of the phase diagram, serially and with a process pool
+        """
+        bs = np.linspace(0, 0.2, 4)
+        ks = np.linspace(0, 0.2, 5)
+        for processes in [1, 2]:
+            cts, stats = phase_diagram(bs, ks, replicates=10, T=10, N=100, processes=processes)
+            self.assertEqual(cts.shape, (5, 4))
+            self.assertTrue(np.all((0 <= stats['min']) & (stats['max'] <= 100)))
+            self.assertTrue(np.all(stats['max'][:, 0] <= 1)) # b = 0: no one besides patient zero gets infected
+            self.assertTrue(np.all(cts[0, :] >= 1)) # k = 0: no one ever recovers
+        # phase= runs every cell and replicate with the given function, on the stream of its row
+        cts, stats = phase_diagram(bs[:2], ks[:2], replicates=2, T=3, N=30, phase=run_simulation_phase, rng=1)
+        rngs = spawn_rngs(1, 2)
+        expected = [[np.mean([run_simulation_phase(b, k, N=30, T=3, rng=rng) for r in range(2)]) for b in bs[:2]]
+                    for k, rng in zip(ks[:2], rngs)]
+        self.assertTrue(np.array_equal(cts, expected))
+
+    def test_adaptive_phase_diagram(self):
+        """
+        Tests that the adaptive phase diagram covers the whole range and needs fewer points than the fine grid
+        """
+        points, cells = adaptive_phase_diagram(coarse=5, resolution=0.0125, replicates=5, N=100)
+        self.assertEqual(points.shape[1], 4)
+        self.assertTrue(np.all((0 <= points[:, 2]) & (points[:, 2] <= 100)))
+        areas = (cells[:, 1] - cells[:, 0])*(cells[:, 3] - cells[:, 2])
+        self.assertAlmostEqual(np.sum(areas), 0.2*0.2)
+        self.assertTrue(len(points) < 17*17) # uniform grid with the same resolution
+
+    def test_iter_simulation(self):
+        """
+        Tests that the generator can be stopped early, even for a very long run
+        """
+        records = []
+        for record in iter_simulation(0.01, 0.05, N=20, T=10**6):
+            records.append(record)
+            if len(records) == 5:
+                break
+        self.assertEqual(records[0], (19, 1, 0))
+        for sus, inf, rec in records:
+            self.assertEqual(sus + inf + rec, 20)
+
+    def test_reproducible(self):
+        """
+        Tests that a seed reproduces a run and that the phase diagram does not depend on the number of processes
+        """
+        self.assertEqual(run_simulation(0.05, 0.05, N=30, T=10, rng=7), run_simulation(0.05, 0.05, N=30, T=10, rng=7))
+        self.assertEqual(run_simulation_binomial(0.05, 0.05, T=10, rng=7), run_simulation_binomial(0.05, 0.05, T=10, rng=7))
+        bs = np.linspace(0, 0.01, 3)
+        ks = np.linspace(0, 0.2, 5)
+        serial, stats = phase_diagram(bs, ks, replicates=5, N=100, processes=1, rng=11)
+        parallel, stats = phase_diagram(bs, ks, replicates=5, N=100, processes=2, rng=11)
+        self.assertTrue(np.all(serial == parallel))
+
+    def test_hybrid(self):
+        """
+        Tests the hybrid stochastic-ODE simulation: a threshold above N never switches to the ODE,
+        and with a low threshold the counts stay consistent and end in the same place as the stochastic model
+        """
+        self.assertEqual(run_simulation_hybrid(0.01, 0.1, N=200, T=30, threshold=1000, rng=3),
+                         run_simulation_binomial(0.01, 0.1, N=200, T=30, rng=3))
+        sus, inf, rec = run_simulation_hybrid(0.0003, 0.1, N=5000, T=100, threshold=50, rng=4)
+        self.assertEqual(len(sus), 101)
+        self.assertTrue(all(s + i + r == 5000 for s, i, r in zip(sus, inf, rec)))
+        self.assertTrue(max(inf) > 50) # the outbreak went through the ODE phase
+        rng = np.random.default_rng(5)
+        hybrid = np.mean([run_simulation_hybrid(0.0003, 0.1, N=5000, T=100, threshold=50, rng=rng)[2][-1] for i in range(30)])
+        binomial = np.mean([run_simulation_binomial(0.0003, 0.1, N=5000, T=100, rng=rng)[2][-1] for i in range(30)])
+        self.assertTrue(abs(hybrid - binomial) < 0.1*5000)
+        # b or k equal to 1 has infinite ODE rates, so the ODE is never used
+        sus, inf, rec = run_simulation_hybrid(1.0, 0.1, N=1000, T=5, threshold=10, rng=6)
+        self.assertEqual(sus[1:], [0]*5)
+        self.assertEqual(run_simulation_hybrid(0.5, 1.0, N=1000, T=5, threshold=10, rng=7),
+                         run_simulation_binomial(0.5, 1.0, N=1000, T=5, rng=7))
     
 
 #############################################################Discrete Spatial Model########################################################################################
@@ -253,6 +372,110 @@ class TestDiscreteSpatialMethod(unittest.TestCase):
                                 cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
                                 self.assertEqual(cts, n)
 
+    def test_iter_spatial(self):
+        """
+        Tests that the spatial generator yields t+1 records with S+I+R = n
+        """
+        records = list(iter_discrete_spatial_simulation(0.05, 0.1, n=30, t=15, position='middle'))
+        self.assertEqual(len(records), 16)
+        for sus, inf, rec in records:
+            self.assertEqual(sus + inf + rec, 30)
+
+    def test_reproducible(self):
+        """
+        Tests that the same seed gives the same spatial trajectory
+        """
+        first = discrete_spatial_simulation(0.05, 0.1, n=30, t=15, rng=5)
+        second = discrete_spatial_simulation(0.05, 0.1, n=30, t=15, rng=5)
+        self.assertEqual(first, second)
+
+    def test_move_positions(self):
+        """
+        Tests that the vectorized moves have the step size of each agent and stay in the grid [0,1]x[0,1]
+        """
+        rng = np.random.default_rng(0)
+        p = np.linspace(0, 0.2, 500)
+        pos = rng.random((500, 2))
+        for i in range(20):
+            old = pos.copy()
+            move_positions(pos, p, rng)
+            dist = np.linalg.norm(pos - old, axis=1)
+            self.assertTrue(np.all((np.abs(dist - p) < 1e-12) | (dist == 0)))
+            self.assertTrue(np.all((0 <= pos) & (pos <= 1)))
+        counts = discrete_spatial_simulation(0.05, 0.1, p=np.full(30, 0.02), n=30, t=5, rng=1)
+        self.assertEqual(len(counts[0]), 6)
+
+    def test_cell_pairs(self):
+        """
+        Tests that the cell list finds exactly the pairs within q found by comparing all distances
+        """
+        rng = np.random.default_rng(1)
+        for n, q in [(300, 0.05), (300, 0.4), (40, 0.01)]:
+            pos = rng.random((n, 2))
+            pos[0] = [1, 1] # on the edge of the grid
+            a = np.arange(0, n, 2)
+            b = np.arange(1, n, 2)
+            i, j = cell_pairs(pos, a, b, q)
+            dist = np.linalg.norm(pos[a][:, None] - pos[b][None, :], axis=2)
+            x, y = np.nonzero(dist <= q)
+            self.assertEqual(sorted(zip(i, j)), sorted(zip(a[x], b[y])))
+
+    def test_cells_backend(self):
+        """
+        Tests the cell list backend: S+I+R = n, and with q covering the grid everyone is infected in one period
+        """
+        sus, inf, rec = discrete_spatial_simulation(0.05, 0.1, n=200, t=15, rng=2, backend='cells')
+        self.assertTrue(all(s + i + r == 200 for s, i, r in zip(sus, inf, rec)))
+        sus, inf, rec = discrete_spatial_simulation(0.0, 1.5, n=50, t=1, num_agents=1, rng=2, backend='cells')
+        self.assertEqual((sus[1], inf[1]), (0, 50))
+
+    def test_verlet(self):
+        """
+        Tests that Verlet lists give the same infections as finding the pairs every period, with fewer rebuilds
+        """
+        fresh = discrete_spatial_simulation(0.05, 0.05, p=0.001, n=500, t=30, rng=6, backend='cells')
+        verlet = discrete_spatial_simulation(0.05, 0.05, p=0.001, n=500, t=30, rng=6, backend='cells', skin=0.03)
+        self.assertEqual(fresh, verlet)
+        for p, skin in [(0.001, 0.03), (0.03, 0.03)]: # lists lasting about skin/(2p) = 15 periods, and too short ones
+            rng = np.random.default_rng(7)
+            pos = rng.random((500, 2))
+            state = np.zeros(500, dtype=np.uint8)
+            state[:250] = INF
+            lists = VerletList(0.05, skin)
+            for t in range(10):
+                move_positions(pos, p, rng)
+                sus, inf = lists.pairs(pos, state)
+                ref_sus, ref_inf = cell_pairs(pos, np.arange(250, 500), np.arange(250), 0.05)
+                self.assertEqual(sorted(zip(sus, inf)), sorted(zip(ref_sus, ref_inf)))
+            self.assertEqual(lists.fallback, p > skin/2)
+            self.assertTrue(lists.rebuilds < 3)
+        self.assertRaises(ValueError, discrete_spatial_simulation, 0.05, 0.05, skin=0.03)
+
+    def test_sweep(self):
+        """
+        Tests that every radius of a sweep gives the same run as discrete_spatial_simulation with backend='cells'
+        """
+        qs = [0.08, 0.03, 0.05]
+        sus, inf, rec = discrete_spatial_sweep(0.1, qs, p=0.03, n=400, t=20, rng=8)
+        self.assertEqual(sus.shape, (3, 21))
+        for r, q in enumerate(qs):
+            single = discrete_spatial_simulation(0.1, q, p=0.03, n=400, t=20, rng=8, backend='cells')
+            self.assertEqual((list(sus[r]), list(inf[r]), list(rec[r])), single)
+
+    def test_replicates(self):
+        """
+        Tests that every replicate of a batch gives the same run as discrete_spatial_simulation with backend='cells'
+        on its spawned stream (so replicates never infect each other)
+        """
+        sus, inf, rec = discrete_spatial_replicates(0.1, 0.05, p=0.03, n=300, t=20, position='corner', replicates=3,
+                                                    rng=9)
+        self.assertEqual(sus.shape, (3, 21))
+        for r, stream in enumerate(spawn_rngs(9, 3)):
+            single = discrete_spatial_simulation(0.1, 0.05, p=0.03, n=300, t=20, position='corner', rng=stream,
+                                                 backend='cells')
+            self.assertEqual((list(sus[r]), list(inf[r]), list(rec[r])), single)
+    
+
 ##########################################################Stochastic Binomial SIR Model########################################################################################
 
 class TestStochasticMethod(unittest.TestCase):
@@ -314,9 +537,390 @@ class TestStochasticMethod(unittest.TestCase):
                     self.assertEqual(len(counts_inf), t)
                     self.assertEqual(len(counts_sus), t)
                     self.assertEqual(len(counts_rec), t)
-                    
-                    
-                    
+
+    def test_iter_stochastic(self):
+        """
+        Tests that the generators yield consecutive times and agree in length with the list versions
+        """
+        for gen in [iter_stochastic_constant_contacts, iter_stochastic_fixed_contacts, iter_stochastic_random_contacts]:
+            records = list(gen(0.1, 3, N=20))
+            times = [record[3] for record in records]
+            self.assertEqual(times, list(range(1, len(records) + 1)))
+            self.assertEqual(records[-1][1], 0)
+            counts_sus, counts_inf, counts_rec, t = collect_trajectory(iter(records))
+            self.assertEqual(len(counts_sus), t)
+
+    def test_reproducible(self):
+        """
+        Tests that the same seed gives the same trajectory
+        """
+        self.assertEqual(stochastic_constant_contacts(0.1, 3, N=30, rng=3), stochastic_constant_contacts(0.1, 3, N=30, rng=3))
+        self.assertEqual(stochastic_random_contacts(0.1, 3, N=30, rng=3), stochastic_random_contacts(0.1, 3, N=30, rng=3))
+
+    def test_numpy_backend(self):
+        """
+        Tests that the vectorized engine keeps S+I+R = N and agrees on average with the loop over agents
+        """
+        for sim in [stochastic_constant_contacts, stochastic_fixed_contacts, stochastic_random_contacts]:
+            counts_sus, counts_inf, counts_rec, t = sim(0.1, 3, N=50, rng=1, backend='numpy')
+            self.assertEqual(len(counts_inf), t)
+            self.assertEqual(counts_inf[-1], 0)
+            for i in range(t):
+                self.assertEqual(counts_sus[i] + counts_inf[i] + counts_rec[i], 50)
+        rng = np.random.default_rng(2)
+        loop = np.mean([stochastic_constant_contacts(0.2, 3, N=50, rng=rng)[2][-1] for i in range(300)])
+        vectorized = np.mean([stochastic_constant_contacts(0.2, 3, N=50, rng=rng, backend='numpy')[2][-1] for i in range(300)])
+        self.assertTrue(abs(loop - vectorized) < 5) # mean final size; the standard error of the difference is below 1
+
+    def test_cohort_backend(self):
+        """
+        Tests the count-level engine: S+I+R = N, infections last exactly R+1 periods, and very large N
+        """
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.1, 3, N=50, rng=4, backend='cohort')
+        self.assertEqual(len(counts_inf), t)
+        self.assertEqual(counts_inf[-1], 0)
+        for i in range(t):
+            self.assertEqual(counts_sus[i] + counts_inf[i] + counts_rec[i], 50)
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.0, 5, N=50, backend='cohort')
+        self.assertEqual((counts_inf, t), ([1]*5 + [0], 6)) # p = 0: patient zero recovers after R+1 periods
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.2, 14, N=10**9, rng=4, backend='cohort')
+        self.assertEqual(counts_sus[-1] + counts_rec[-1], 10**9)
+
+    def test_grouped_infections(self):
+        """
+        Tests the grouped binomial kernel and the count-level engine for heterogeneous contacts
+        """
+        rng = np.random.default_rng(6)
+        s_levels = np.array([10, 20, 30])
+        self.assertEqual(list(grouped_infections(s_levels, [0, 1, 2], 0.0, 5, 100, rng)), [0, 0, 0])
+        self.assertEqual(list(grouped_infections(s_levels, [0, 1, 2], 1.0, 99, 100, rng)), [0, 20, 30]) # no contacts, no infection
+        for sim in [stochastic_fixed_contacts, stochastic_random_contacts]:
+            counts_sus, counts_inf, counts_rec, t = sim(0.1, 3, N=10**8, rng=rng, backend='cohort')
+            self.assertEqual(counts_inf[-1], 0)
+            self.assertEqual(counts_sus[-1] + counts_rec[-1], 10**8)
+        loop = np.mean([stochastic_random_contacts(0.05, 3, N=50, rng=rng, backend='numpy')[2][-1] for i in range(300)])
+        counts = np.mean([stochastic_random_contacts(0.05, 3, N=50, rng=rng, backend='cohort')[2][-1] for i in range(300)])
+        self.assertTrue(abs(loop - counts) < 5) # mean final size
+
+    def test_ensemble(self):
+        """
+        Tests the ensemble peaks and durations against the definitions used with stochastic_constant_contacts
+        """
+        for counts_only in [True, False]:
+            peaks, durations = stochastic_ensemble(0.0, 4, trials=20, N=30, counts_only=counts_only)
+            self.assertTrue(np.all(peaks == 1) and np.all(durations == 5)) # p = 0: patient zero recovers after R+1 periods
+            peaks, durations = stochastic_ensemble(0.3, 2, trials=200, N=30, counts_only=counts_only, rng=8)
+            self.assertTrue(np.all((1 <= peaks) & (peaks <= 30)))
+            self.assertTrue(np.all(durations >= 3))
+        rng = np.random.default_rng(9)
+        single = np.mean([stochastic_constant_contacts(0.3, 2, N=30, rng=rng, backend='numpy')[3] for i in range(300)])
+        self.assertTrue(abs(np.mean(durations) - single) < 3) # mean duration
+
+    def test_branching(self):
+        """
+        Tests the extinction probability and that the handoff from counts to agents keeps the trajectory consistent
+        """
+        self.assertEqual(extinction_probability(0.05, 2, 4), 1.0) # m = 0.6 < 1: the pandemic always dies out
+        q = extinction_probability(0.1, 2, 4)
+        self.assertTrue(abs(q - np.exp(1.2*(q - 1))) < 1e-10)
+        for backend in ['python', 'numpy']:
+            sus, inf, rec, t = stochastic_constant_contacts(0.3, 2, N=50, rng=4, backend=backend, handoff=5)
+            self.assertEqual(len(inf), t)
+            self.assertTrue(all(s + i + r == 50 for s, i, r in zip(sus, inf, rec)))
+            self.assertEqual(inf[-1], 0)
+        rng = np.random.default_rng(5)
+        minor = np.mean([stochastic_constant_contacts(0.1, 2, N=500, rng=rng, backend='numpy', handoff=10)[2][-1] < 50
+                         for i in range(300)])
+        self.assertTrue(abs(minor - q) < 0.1)
+        self.assertRaises(ValueError, stochastic_constant_contacts, 0.1, 2, backend='cohort', handoff=10)
+
+    def test_hybrid(self):
+        """
+        Tests the hybrid stochastic-ODE simulation: a threshold above N gives the count-level model,
+        and with a low threshold the pandemic still ends with the final size of the stochastic model
+        """
+        self.assertEqual(stochastic_constant_contacts_hybrid(0.2, 3, N=100, threshold=1000, rng=3),
+                         stochastic_constant_contacts(0.2, 3, N=100, rng=3, backend='cohort'))
+        sus, inf, rec, t = stochastic_constant_contacts_hybrid(0.2, 3, N=5000, threshold=50, rng=4)
+        self.assertEqual(len(inf), t)
+        self.assertEqual(inf[-1], 0)
+        self.assertTrue(all(s + i + r == 5000 for s, i, r in zip(sus, inf, rec)))
+        rng = np.random.default_rng(5)
+        hybrid = [stochastic_constant_contacts_hybrid(0.2, 3, N=5000, threshold=50, rng=rng)[2][-1] for i in range(30)]
+        cohort = [stochastic_constant_contacts(0.2, 3, N=5000, rng=rng, backend='cohort')[2][-1] for i in range(30)]
+        self.assertTrue(abs(np.median(hybrid) - np.median(cohort)) < 0.05*5000)
+    
+
+###########################################################Population Container########################################################################################
+
+class TestPopulation(unittest.TestCase):
+
+    def test_change_state(self):
+        """
+        Tests that change_state goes from S to I to R and keeps the tallies up to date
+        """
+        pop = Population(10)
+        self.assertEqual(pop.state[3], SUSC)
+        pop.change_state(3)
+        self.assertEqual(pop.state[3], INF)
+        pop.change_state(3)
+        pop.change_state(3)
+        self.assertEqual(pop.state[3], REC)
+        self.assertEqual((pop.count_susc(), pop.count_infected(), pop.count_recovered()), (9, 0, 1))
+
+    def test_tallies(self):
+        """
+        Tests that the running tallies agree with a full census after vectorized transitions
+        """
+        pop = Population(100)
+        pop.infect(np.arange(20))
+        pop.recover(np.arange(5, 15))
+        pop.infect(np.array([50]))
+        census = np.bincount(pop.state, minlength=3)
+        self.assertEqual(pop.count_susc(), census[SUSC])
+        self.assertEqual(pop.count_infected(), census[INF])
+        self.assertEqual(pop.count_recovered(), census[REC])
+        self.assertEqual(pop.count_susc() + pop.count_infected() + pop.count_recovered(), len(pop))
+
+    def test_census_chunks(self):
+        """
+        Tests that census_chunks groups records into arrays of the requested size
+        """
+        records = ((i, 2*i, 3*i) for i in range(10))
+        chunks = list(census_chunks(records, size=4))
+        self.assertEqual([chunk.shape for chunk in chunks], [(4, 3), (4, 3), (2, 3)])
+        self.assertEqual(chunks[2][1, 2], 27)
+    
+
+###########################################################Random Streams########################################################################################
+
+class TestRandomStreams(unittest.TestCase):
+
+    def test_make_rng(self):
+        """
+        Tests that a seed gives a reproducible stream and that a Generator is passed through
+        """
+        self.assertEqual(make_rng(5).random(), make_rng(5).random())
+        rng = np.random.default_rng(1)
+        self.assertIs(make_rng(rng), rng)
+
+    def test_spawn_rngs(self):
+        """
+        Tests that spawned streams are reproducible and differ from each other
+        """
+        first = [rng.random(3) for rng in spawn_rngs(42, 4)]
+        second = [rng.random(3) for rng in spawn_rngs(42, 4)]
+        for a, b in zip(first, second):
+            self.assertTrue(np.all(a == b))
+        self.assertFalse(np.any(first[0] == first[1]))
+        self.assertEqual(len(spawn_rngs(np.random.default_rng(0), 3)), 3)
+
+    def test_child_rng(self):
+        """
+        Tests that a child stream is reproducible, differs from its parent and does not draw from it
+        """
+        rng = np.random.default_rng(7)
+        child = child_rng(rng)
+        self.assertEqual(rng.random(), np.random.default_rng(7).random())
+        self.assertEqual(child.random(), child_rng(np.random.default_rng(7)).random())
+        self.assertNotEqual(child_rng(np.random.default_rng(7)).random(), np.random.default_rng(7).random())
+
+
+###########################################################Compiled Kernels########################################################################################
+
+class TestKernels(unittest.TestCase):
+
+    def test_select_backend(self):
+        """
+        Tests that 'auto' falls back to python without numba and that unknown backends are rejected
+        """
+        self.assertEqual(select_backend('python'), 'python')
+        self.assertEqual(select_backend('auto'), 'numba' if HAVE_NUMBA else 'python')
+        self.assertRaises(ValueError, select_backend, 'fortran')
+        if not HAVE_NUMBA:
+            self.assertRaises(ImportError, select_backend, 'numba')
+
+    def test_steps(self):
+        """
+        Tests that the kernels report the transitions they make on the state array
+        (without numba the kernels run as plain Python functions)
+        """
+        seed_kernels(0)
+        empty = np.empty(0, dtype=np.int32) # no infection log
+        state = np.zeros(50, dtype=np.uint8)
+        state[:3] = INF
+        new_inf, new_rec = discrete_step(state, 0.1, 0.5, 1, empty, empty, empty)
+        self.assertEqual(np.sum(state == INF), 3 + new_inf - new_rec)
+        self.assertEqual(np.sum(state == REC), new_rec)
+
+        state = np.zeros(50, dtype=np.uint8)
+        state[0] = INF
+        t_firstinf = np.zeros(50)
+        new_inf, new_rec = stochastic_step(state, t_firstinf, np.full(50, 4), 0.5, 0, 1, 1)
+        self.assertEqual(new_rec, 1) # R = 0: patient zero recovers after one period
+        self.assertEqual(np.sum(state == INF), new_inf)
+
+        state = np.zeros(3, dtype=np.uint8)
+        state[0] = INF
+        pos = np.array([[0.5, 0.5], [0.55, 0.5], [0.9, 0.9]])
+        t_inf, t_rec, infector = np.full((3, 3), -1, dtype=np.int32)
+        new_inf, new_rec = spatial_step(state, pos, 0.1, 0.0, 4, t_inf, t_rec, infector)
+        self.assertEqual((new_inf, new_rec), (1, 0))
+        self.assertEqual(list(state), [INF, INF, SUSC])
+        self.assertEqual(list(t_inf), [-1, 4, -1]) # agent 1 infected at time 4 by agent 0
+        self.assertEqual(list(infector), [-1, 0, -1])
+
+
+###########################################################Monte Carlo##############################################################################################
+
+class TestMonteCarlo(unittest.TestCase):
+
+    def test_histogram(self):
+        """
+        Tests that merged histograms give the same statistics as the values they were built from
+        """
+        values = np.random.default_rng(0).integers(0, 50, size=1000)
+        h = Histogram(values[:300])
+        h.merge(Histogram(values[300:600]))
+        h.add(values[600:])
+        self.assertEqual(len(h), 1000)
+        self.assertAlmostEqual(h.mean(), values.mean())
+        self.assertAlmostEqual(h.std(), values.std())
+        self.assertEqual(h.quantile(0.5), np.quantile(values, 0.5, method='inverted_cdf'))
+
+    def test_monte_carlo(self):
+        """
+        Tests that the summaries cover every trial and do not depend on the number of shards
+        """
+        hists = monte_carlo(0.3, 3, trials=250, N=50, chunk=100, rng=7)
+        for name in ('peak', 'peak_time', 'duration', 'final_size'):
+            self.assertEqual(len(hists[name]), 250)
+        self.assertTrue(hists['final_size'].quantile(1.0) <= 50)
+        self.assertTrue(hists['peak'].quantile(0.0) >= 1)
+        again = monte_carlo(0.3, 3, trials=250, N=50, chunk=100, processes=2, rng=7)
+        self.assertTrue(np.all(again['duration'].counts == hists['duration'].counts))
+
+    def test_sequential(self):
+        """
+        Tests that the sequential runner stops once the interval is narrow enough and reports the trials used
+        """
+        res = sequential_monte_carlo(0.1, 2, target='mean', tol=1.0, batch=100, N=50, rng=3)
+        self.assertTrue(res['halfwidth'] <= 1.0)
+        self.assertEqual(res['trials'] % 100, 0)
+        res = sequential_monte_carlo(0.1, 2, target='mean', tol=0.0, batch=100, max_trials=250, N=50, rng=3)
+        self.assertEqual(res['trials'], 250)
+        res = sequential_monte_carlo(0.3, 3, target='quantile', statistic='duration', q=0.5, tol=1.0, batch=100, N=50, rng=3)
+        self.assertTrue(res['halfwidth'] <= 1.0)
+        res = sequential_monte_carlo(0.01, 0, target='extinction', tol=0.05, batch=100, N=50, rng=3)
+        self.assertTrue(res['estimate'] > 0.9) # far below threshold almost every pandemic dies out
+        # one pool serves all batches, and with a fixed chunk the result does not depend on processes
+        serial = sequential_monte_carlo(0.1, 2, tol=0.3, batch=100, N=50, chunk=25, rng=4)
+        self.assertEqual(sequential_monte_carlo(0.1, 2, tol=0.3, batch=100, N=50, chunk=25, processes=2, rng=4), serial)
+        self.assertRaises(ValueError, sequential_monte_carlo, 0.1, 2, target='median')
+
+    def test_splitting(self):
+        """
+        Tests the splitting estimator against plain Monte Carlo on a tail that plain trials can still resolve
+        """
+        summaries = ensemble_summaries(0.05, 2, trials=50_000, N=50, rng=1)
+        for statistic, levels in [('peak', [3, 5, 8]), ('duration', [10, 15, 20])]:
+            naive = np.mean(summaries[statistic] >= levels[-1])
+            res = splitting_probability(0.05, 2, levels, statistic=statistic, particles=2000, N=50, rng=2)
+            self.assertEqual(len(res['fractions']), 3)
+            self.assertTrue(abs(res['estimate'] - naive) < 4*res['std'] + 0.001)
+        res = splitting_probability(0.0, 2, [2], N=50) # p = 0: no one else is ever infected
+        self.assertEqual(res['estimate'], 0.0)
+    
+
+###########################################################Stochastic Simulation Algorithm##########################################################################
+
+class TestGillespie(unittest.TestCase):
+
+    def test_shapes(self):
+        """
+        Tests the shape of the outputs and that S + I + R = N at every time
+        """
+        t_eval = np.linspace(0, 50, 11)
+        for engine in [gillespie, tau_leaping]:
+            S, I, R = engine(0.3, 0.1, N=500, I0=5, t_eval=t_eval, rng=1)
+            self.assertEqual(S.shape, (11,))
+            self.assertEqual((S[0], I[0], R[0]), (495, 5, 0))
+            S, I, R = engine(0.3, 0.1, N=500, I0=5, t_eval=t_eval, replicates=4, rng=1)
+            self.assertEqual(S.shape, (4, 11))
+            self.assertTrue(np.all(S + I + R == 500))
+            self.assertTrue(np.all(np.diff(S, axis=1) <= 0))
+
+    def test_recovery(self):
+        """
+        Tests that with b = 0 the mean number of infected decays as I0*exp(-k*t)
+        """
+        S, I, R = gillespie(0.0, 0.2, N=100, I0=100, t_eval=[0, 5], replicates=400, rng=2)
+        self.assertTrue(abs(I[:, 1].mean() - 100*np.exp(-1)) < 2)
+        self.assertTrue(np.all(S == 0))
+
+    def test_ode_limit(self):
+        """
+        Tests that both engines follow the solution of the ODE f for a large population
+        (tau-leaping is compared on the mean of a few replicates, since its leaps add a small bias)
+        """
+        b, k, N = 0.3, 0.1, 20_000
+        t_eval = np.linspace(0, 100, 21)
+        sol = solve_ivp(f, (0, 100), [1 - 200/N, 200/N, 0], args=([b, k],), t_eval=t_eval, rtol=1e-8)
+        S, I, R = gillespie(b, k, N=N, I0=200, t_eval=t_eval, rng=3)
+        self.assertTrue(np.max(np.abs(I/N - sol.y[1])) < 0.02)
+        S, I, R = tau_leaping(b, k, N=N, I0=200, t_eval=t_eval, replicates=20, rng=3)
+        self.assertTrue(np.max(np.abs(I.mean(axis=0)/N - sol.y[1])) < 0.01)
+
+
+###########################################################Transmission Trees#######################################################################################
+
+class TestTransmission(unittest.TestCase):
+
+    def test_log_models(self):
+        """
+        Tests that the logs of the agent models agree with their counts
+        """
+        log = InfectionLog(200)
+        S, I, R = run_simulation(0.005, 0.1, N=200, T=20, rng=1, log=log)
+        self.assertEqual(np.sum(log.t_inf >= 0), 200 - S[-1])
+        self.assertEqual(np.sum(log.t_rec >= 0), R[-1])
+        self.assertEqual(log.t_inf.dtype, np.int32)
+
+        log = InfectionLog(300)
+        S, I, R = discrete_spatial_simulation(0.1, 0.05, n=300, t=10, rng=1, log=log)
+        self.assertEqual(np.sum(log.t_inf >= 0), 300 - S[-1])
+        self.assertEqual(np.sum(log.infector == -1) - S[-1], 5) # only the initial infected have no infector
+
+        for backend in ['python', 'numpy']:
+            log = InfectionLog(300)
+            S, I, R, t = stochastic_constant_contacts(0.2, 4, N=300, rng=3, backend=backend, log=log)
+            self.assertEqual(np.sum(log.t_rec >= 0), R[-1])
+            self.assertTrue(np.all(log.t_rec[log.t_rec >= 0] - log.t_inf[log.t_rec >= 0] == 5)) # recover after R+1
+            self.assertTrue(np.all((1 <= generation_intervals(log)) & (generation_intervals(log) <= 5)))
+            # the infectors are drawn from their own stream, so logging leaves the counts unchanged for a seed
+            self.assertEqual((S, I, R, t), stochastic_constant_contacts(0.2, 4, N=300, rng=3, backend=backend))
+            self.assertEqual(stochastic_random_contacts(0.1, 4, N=300, rng=4, backend=backend, log=InfectionLog(300)),
+                             stochastic_random_contacts(0.1, 4, N=300, rng=4, backend=backend))
+        self.assertRaises(ValueError, stochastic_constant_contacts, 0.2, 4, backend='cohort', log=InfectionLog(200))
+
+    def test_post_processing(self):
+        """
+        Tests the post-processing functions on a small transmission tree
+        """
+        log = InfectionLog(5)
+        log.infect(0, 0) # 0 infects 1 and 2 at time 1, 1 infects 3 at time 3; 4 is never infected
+        log.infect([1, 2], 1, 0)
+        log.infect(3, 3, 1)
+        log.recover([0, 1, 2], 4)
+        self.assertEqual(list(offspring_counts(log)), [2, 1, 0, 0, 0])
+        self.assertEqual(list(offspring_distribution(log)), [1, 1, 1])
+        self.assertEqual(list(offspring_distribution(log, recovered_only=False)), [2, 1, 1])
+        self.assertEqual(sorted(generation_intervals(log)), [1, 1, 2])
+        R_t = reproduction_number(log)
+        self.assertEqual(list(R_t[[0, 1, 3]]), [2.0, 0.5, 0.0])
+        self.assertTrue(np.isnan(R_t[2]))
+
+
 ###########################################################Spatial PDE Model########################################################################################
 
 class TestSpatialODEs(unittest.TestCase):
@@ -47,4 +47,117 @@ class TestDiscreteMethod(unittest.TestCase):
                         counts_sus, counts_inf, counts_rec = run_simulation(b, k, N=n, T=t)
                         for i in range(len(counts_sus)):
                             cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
-                            self.assertEqual(cts, n)
\ No newline at end of file
+                            self.assertEqual(cts, n)
+
+    def test_sum_array(self):
+        """
+        Tests that S+I+R = N for the array-backed engine in both update orders
+        """
+        for sequential in [False, True]:
+            for n in [10, 20, 30]:
+                counts_sus, counts_inf, counts_rec = run_simulation_array(0.1, 0.05, N=n, T=20, sequential=sequential)
+                self.assertEqual(len(counts_sus), 21)
+                for i in range(len(counts_sus)):
+                    cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
+                    self.assertEqual(cts, n)
+
+    def test_sum_binomial(self):
+        """
+        Tests that S+I+R = N for the chain binomial engine, also for a very large population
+        """
+        for n in [10, 1_000, 10**8]:
+            counts_sus, counts_inf, counts_rec = run_simulation_binomial(0.1, 0.05, N=n, T=20)
+            self.assertEqual(len(counts_sus), 21)
+            for i in range(len(counts_sus)):
+                cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
+                self.assertEqual(cts, n)
+            self.assertTrue(0 <= run_simulation_phase_binomial(0.1, 0.05, N=n, T=10) <= n)
+
+    def test_ensemble(self):
+        """
+        Tests the shape of the ensemble output and that S+I+R = N for every replicate
+        """
+        for counts_only in [False, True]:
+            counts_sus, counts_inf, counts_rec = run_ensemble(0.01, 0.05, N=50, T=20, replicates=30, counts_only=counts_only)
+            self.assertEqual(counts_sus.shape, (30, 21))
+            self.assertTrue(np.all(counts_sus + counts_inf + counts_rec == 50))
+            self.assertEqual(ensemble_mean(counts_inf).shape, (21,))
+            bands = ensemble_quantiles(counts_inf)
+            self.assertEqual(bands.shape, (3, 21))
+            self.assertTrue(np.all(bands[0] <= bands[2]))
+
+    def test_phase_diagram(self):
+        """
+        Tests the shape and range of the phase diagram, serially and with a process pool
+        """
+        bs = np.linspace(0, 0.2, 4)
+        ks = np.linspace(0, 0.2, 5)
+        for processes in [1, 2]:
+            cts, stats = phase_diagram(bs, ks, replicates=10, T=10, N=100, processes=processes)
+            self.assertEqual(cts.shape, (5, 4))
+            self.assertTrue(np.all((0 <= stats['min']) & (stats['max'] <= 100)))
+            self.assertTrue(np.all(stats['max'][:, 0] <= 1)) # b = 0: no one besides patient zero gets infected
+            self.assertTrue(np.all(cts[0, :] >= 1)) # k = 0: no one ever recovers
+        # phase= runs every cell and replicate with the given function, on the stream of its row
+        cts, stats = phase_diagram(bs[:2], ks[:2], replicates=2, T=3, N=30, phase=run_simulation_phase, rng=1)
+        rngs = spawn_rngs(1, 2)
+        expected = [[np.mean([run_simulation_phase(b, k, N=30, T=3, rng=rng) for r in range(2)]) for b in bs[:2]]
+                    for k, rng in zip(ks[:2], rngs)]
+        self.assertTrue(np.array_equal(cts, expected))
+
+    def test_adaptive_phase_diagram(self):
+        """
+        Tests that the adaptive phase diagram covers the whole range and needs fewer points than the fine grid
+        """
+        points, cells = adaptive_phase_diagram(coarse=5, resolution=0.0125, replicates=5, N=100)
+        self.assertEqual(points.shape[1], 4)
+        self.assertTrue(np.all((0 <= points[:, 2]) & (points[:, 2] <= 100)))
+        areas = (cells[:, 1] - cells[:, 0])*(cells[:, 3] - cells[:, 2])
+        self.assertAlmostEqual(np.sum(areas), 0.2*0.2)
+        self.assertTrue(len(points) < 17*17) # uniform grid with the same resolution
+
+    def test_iter_simulation(self):
+        """
+        Tests that the generator can be stopped early, even for a very long run
+        """
+        records = []
+        for record in iter_simulation(0.01, 0.05, N=20, T=10**6):
+            records.append(record)
+            if len(records) == 5:
+                break
+        self.assertEqual(records[0], (19, 1, 0))
+        for sus, inf, rec in records:
+            self.assertEqual(sus + inf + rec, 20)
+
+    def test_reproducible(self):
+        """
+        Tests that a seed reproduces a run and that the phase diagram does not depend on the number of processes
+        """
+        self.assertEqual(run_simulation(0.05, 0.05, N=30, T=10, rng=7), run_simulation(0.05, 0.05, N=30, T=10, rng=7))
+        self.assertEqual(run_simulation_binomial(0.05, 0.05, T=10, rng=7), run_simulation_binomial(0.05, 0.05, T=10, rng=7))
+        bs = np.linspace(0, 0.01, 3)
+        ks = np.linspace(0, 0.2, 5)
+        serial, stats = phase_diagram(bs, ks, replicates=5, N=100, processes=1, rng=11)
+        parallel, stats = phase_diagram(bs, ks, replicates=5, N=100, processes=2, rng=11)
+        self.assertTrue(np.all(serial == parallel))
+
+    def test_hybrid(self):
+        """
+        Tests the hybrid stochastic-ODE simulation: a threshold above N never switches to the ODE,
+        and with a low threshold the counts stay consistent and end in the same place as the stochastic model
+        """
+        self.assertEqual(run_simulation_hybrid(0.01, 0.1, N=200, T=30, threshold=1000, rng=3),
+                         run_simulation_binomial(0.01, 0.1, N=200, T=30, rng=3))
+        sus, inf, rec = run_simulation_hybrid(0.0003, 0.1, N=5000, T=100, threshold=50, rng=4)
+        self.assertEqual(len(sus), 101)
+        self.assertTrue(all(s + i + r == 5000 for s, i, r in zip(sus, inf, rec)))
+        self.assertTrue(max(inf) > 50) # the outbreak went through the ODE phase
+        rng = np.random.default_rng(5)
+        hybrid = np.mean([run_simulation_hybrid(0.0003, 0.1, N=5000, T=100, threshold=50, rng=rng)[2][-1] for i in range(30)])
+        binomial = np.mean([run_simulation_binomial(0.0003, 0.1, N=5000, T=100, rng=rng)[2][-1] for i in range(30)])
+        self.assertTrue(abs(hybrid - binomial) < 0.1*5000)
+        # b or k equal to 1 has infinite ODE rates, so the ODE is never used
+        sus, inf, rec = run_simulation_hybrid(1.0, 0.1, N=1000, T=5, threshold=10, rng=6)
+        self.assertEqual(sus[1:], [0]*5)
+        self.assertEqual(run_simulation_hybrid(0.5, 1.0, N=1000, T=5, threshold=10, rng=7),
+                         run_simulation_binomial(0.5, 1.0, N=1000, T=5, rng=7))
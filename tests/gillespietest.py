@@ -0,0 +1,43 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.gillespie import *
+from sir.ode_function import f
+from scipy.integrate import solve_ivp
+
+class TestGillespie(unittest.TestCase):
+
+    def test_shapes(self):
+        """
+        Tests the shape of the outputs and that S + I + R = N at every time
+        """
+        t_eval = np.linspace(0, 50, 11)
+        for engine in [gillespie, tau_leaping]:
+            S, I, R = engine(0.3, 0.1, N=500, I0=5, t_eval=t_eval, rng=1)
+            self.assertEqual(S.shape, (11,))
+            self.assertEqual((S[0], I[0], R[0]), (495, 5, 0))
+            S, I, R = engine(0.3, 0.1, N=500, I0=5, t_eval=t_eval, replicates=4, rng=1)
+            self.assertEqual(S.shape, (4, 11))
+            self.assertTrue(np.all(S + I + R == 500))
+            self.assertTrue(np.all(np.diff(S, axis=1) <= 0))
+
+    def test_recovery(self):
+        """
+        Tests that with b = 0 the mean number of infected decays as I0*exp(-k*t)
+        """
+        S, I, R = gillespie(0.0, 0.2, N=100, I0=100, t_eval=[0, 5], replicates=400, rng=2)
+        self.assertTrue(abs(I[:, 1].mean() - 100*np.exp(-1)) < 2)
+        self.assertTrue(np.all(S == 0))
+
+    def test_ode_limit(self):
+        """
+        Tests that both engines follow the solution of the ODE f for a large population
+        (tau-leaping is compared on the mean of a few replicates, since its leaps add a small bias)
+        """
+        b, k, N = 0.3, 0.1, 20_000
+        t_eval = np.linspace(0, 100, 21)
+        sol = solve_ivp(f, (0, 100), [1 - 200/N, 200/N, 0], args=([b, k],), t_eval=t_eval, rtol=1e-8)
+        S, I, R = gillespie(b, k, N=N, I0=200, t_eval=t_eval, rng=3)
+        self.assertTrue(np.max(np.abs(I/N - sol.y[1])) < 0.02)
+        S, I, R = tau_leaping(b, k, N=N, I0=200, t_eval=t_eval, replicates=20, rng=3)
+        self.assertTrue(np.max(np.abs(I.mean(axis=0)/N - sol.y[1])) < 0.01)
@@ -0,0 +1,46 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.kernels import *
+
+class TestKernels(unittest.TestCase):
+
+    def test_select_backend(self):
+        """
+        Tests that 'auto' falls back to python without numba and that unknown backends are rejected
+        """
+        self.assertEqual(select_backend('python'), 'python')
+        self.assertEqual(select_backend('auto'), 'numba' if HAVE_NUMBA else 'python')
+        self.assertRaises(ValueError, select_backend, 'fortran')
+        if not HAVE_NUMBA:
+            self.assertRaises(ImportError, select_backend, 'numba')
+
+    def test_steps(self):
+        """
+        Tests that the kernels report the transitions they make on the state array
+        (without numba the kernels run as plain Python functions)
+        """
+        seed_kernels(0)
+        empty = np.empty(0, dtype=np.int32) # no infection log
+        state = np.zeros(50, dtype=np.uint8)
+        state[:3] = INF
+        new_inf, new_rec = discrete_step(state, 0.1, 0.5, 1, empty, empty, empty)
+        self.assertEqual(np.sum(state == INF), 3 + new_inf - new_rec)
+        self.assertEqual(np.sum(state == REC), new_rec)
+
+        state = np.zeros(50, dtype=np.uint8)
+        state[0] = INF
+        t_firstinf = np.zeros(50)
+        new_inf, new_rec = stochastic_step(state, t_firstinf, np.full(50, 4), 0.5, 0, 1, 1)
+        self.assertEqual(new_rec, 1) # R = 0: patient zero recovers after one period
+        self.assertEqual(np.sum(state == INF), new_inf)
+
+        state = np.zeros(3, dtype=np.uint8)
+        state[0] = INF
+        pos = np.array([[0.5, 0.5], [0.55, 0.5], [0.9, 0.9]])
+        t_inf, t_rec, infector = np.full((3, 3), -1, dtype=np.int32)
+        new_inf, new_rec = spatial_step(state, pos, 0.1, 0.0, 4, t_inf, t_rec, infector)
+        self.assertEqual((new_inf, new_rec), (1, 0))
+        self.assertEqual(list(state), [INF, INF, SUSC])
+        self.assertEqual(list(t_inf), [-1, 4, -1]) # agent 1 infected at time 4 by agent 0
+        self.assertEqual(list(infector), [-1, 0, -1])
@@ -0,0 +1,62 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.montecarlo import *
+
+class TestMonteCarlo(unittest.TestCase):
+
+    def test_histogram(self):
+        """
+        Tests that merged histograms give the same statistics as the values they were built from
+        """
+        values = np.random.default_rng(0).integers(0, 50, size=1000)
+        h = Histogram(values[:300])
+        h.merge(Histogram(values[300:600]))
+        h.add(values[600:])
+        self.assertEqual(len(h), 1000)
+        self.assertAlmostEqual(h.mean(), values.mean())
+        self.assertAlmostEqual(h.std(), values.std())
+        self.assertEqual(h.quantile(0.5), np.quantile(values, 0.5, method='inverted_cdf'))
+
+    def test_monte_carlo(self):
+        """
+        Tests that the summaries cover every trial and do not depend on the number of shards
+        """
+        hists = monte_carlo(0.3, 3, trials=250, N=50, chunk=100, rng=7)
+        for name in ('peak', 'peak_time', 'duration', 'final_size'):
+            self.assertEqual(len(hists[name]), 250)
+        self.assertTrue(hists['final_size'].quantile(1.0) <= 50)
+        self.assertTrue(hists['peak'].quantile(0.0) >= 1)
+        again = monte_carlo(0.3, 3, trials=250, N=50, chunk=100, processes=2, rng=7)
+        self.assertTrue(np.all(again['duration'].counts == hists['duration'].counts))
+
+    def test_sequential(self):
+        """
+        Tests that the sequential runner stops once the interval is narrow enough and reports the trials used
+        """
+        res = sequential_monte_carlo(0.1, 2, target='mean', tol=1.0, batch=100, N=50, rng=3)
+        self.assertTrue(res['halfwidth'] <= 1.0)
+        self.assertEqual(res['trials'] % 100, 0)
+        res = sequential_monte_carlo(0.1, 2, target='mean', tol=0.0, batch=100, max_trials=250, N=50, rng=3)
+        self.assertEqual(res['trials'], 250)
+        res = sequential_monte_carlo(0.3, 3, target='quantile', statistic='duration', q=0.5, tol=1.0, batch=100, N=50, rng=3)
+        self.assertTrue(res['halfwidth'] <= 1.0)
+        res = sequential_monte_carlo(0.01, 0, target='extinction', tol=0.05, batch=100, N=50, rng=3)
+        self.assertTrue(res['estimate'] > 0.9) # far below threshold almost every pandemic dies out
+        # one pool serves all batches, and with a fixed chunk the result does not depend on processes
+        serial = sequential_monte_carlo(0.1, 2, tol=0.3, batch=100, N=50, chunk=25, rng=4)
+        self.assertEqual(sequential_monte_carlo(0.1, 2, tol=0.3, batch=100, N=50, chunk=25, processes=2, rng=4), serial)
+        self.assertRaises(ValueError, sequential_monte_carlo, 0.1, 2, target='median')
+
+    def test_splitting(self):
+        """
+        Tests the splitting estimator against plain Monte Carlo on a tail that plain trials can still resolve
+        """
+        summaries = ensemble_summaries(0.05, 2, trials=50_000, N=50, rng=1)
+        for statistic, levels in [('peak', [3, 5, 8]), ('duration', [10, 15, 20])]:
+            naive = np.mean(summaries[statistic] >= levels[-1])
+            res = splitting_probability(0.05, 2, levels, statistic=statistic, particles=2000, N=50, rng=2)
+            self.assertEqual(len(res['fractions']), 3)
+            self.assertTrue(abs(res['estimate'] - naive) < 4*res['std'] + 0.001)
+        res = splitting_probability(0.0, 2, [2], N=50) # p = 0: no one else is ever infected
+        self.assertEqual(res['estimate'], 0.0)
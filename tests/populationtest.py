@@ -0,0 +1,42 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.population import *
+
+class TestPopulation(unittest.TestCase):
+
+    def test_change_state(self):
+        """
+        Tests that change_state goes from S to I to R and keeps the tallies up to date
+        """
+        pop = Population(10)
+        self.assertEqual(pop.state[3], SUSC)
+        pop.change_state(3)
+        self.assertEqual(pop.state[3], INF)
+        pop.change_state(3)
+        pop.change_state(3)
+        self.assertEqual(pop.state[3], REC)
+        self.assertEqual((pop.count_susc(), pop.count_infected(), pop.count_recovered()), (9, 0, 1))
+
+    def test_tallies(self):
+        """
+        Tests that the running tallies agree with a full census after vectorized transitions
+        """
+        pop = Population(100)
+        pop.infect(np.arange(20))
+        pop.recover(np.arange(5, 15))
+        pop.infect(np.array([50]))
+        census = np.bincount(pop.state, minlength=3)
+        self.assertEqual(pop.count_susc(), census[SUSC])
+        self.assertEqual(pop.count_infected(), census[INF])
+        self.assertEqual(pop.count_recovered(), census[REC])
+        self.assertEqual(pop.count_susc() + pop.count_infected() + pop.count_recovered(), len(pop))
+
+    def test_census_chunks(self):
+        """
+        Tests that census_chunks groups records into arrays of the requested size
+        """
+        records = ((i, 2*i, 3*i) for i in range(10))
+        chunks = list(census_chunks(records, size=4))
+        self.assertEqual([chunk.shape for chunk in chunks], [(4, 3), (4, 3), (2, 3)])
+        self.assertEqual(chunks[2][1, 2], 27)
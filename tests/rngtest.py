@@ -0,0 +1,35 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.rng import *
+
+class TestRandomStreams(unittest.TestCase):
+
+    def test_make_rng(self):
+        """
+        Tests that a seed gives a reproducible stream and that a Generator is passed through
+        """
+        self.assertEqual(make_rng(5).random(), make_rng(5).random())
+        rng = np.random.default_rng(1)
+        self.assertIs(make_rng(rng), rng)
+
+    def test_spawn_rngs(self):
+        """
+        Tests that spawned streams are reproducible and differ from each other
+        """
+        first = [rng.random(3) for rng in spawn_rngs(42, 4)]
+        second = [rng.random(3) for rng in spawn_rngs(42, 4)]
+        for a, b in zip(first, second):
+            self.assertTrue(np.all(a == b))
+        self.assertFalse(np.any(first[0] == first[1]))
+        self.assertEqual(len(spawn_rngs(np.random.default_rng(0), 3)), 3)
+
+    def test_child_rng(self):
+        """
+        Tests that a child stream is reproducible, differs from its parent and does not draw from it
+        """
+        rng = np.random.default_rng(7)
+        child = child_rng(rng)
+        self.assertEqual(rng.random(), np.random.default_rng(7).random())
+        self.assertEqual(child.random(), child_rng(np.random.default_rng(7)).random())
+        self.assertNotEqual(child_rng(np.random.default_rng(7)).random(), np.random.default_rng(7).random())
@@ -60,4 +60,107 @@ class TestDiscreteSpatialMethod(unittest.TestCase):
                             counts_sus, counts_inf, counts_rec = discrete_spatial_simulation(k, q, t=t, n=n, position=p)
                             for i in range(len(counts_sus)):
                                 cts = counts_sus[i] + counts_inf[i] + counts_rec[i]
-                                self.assertEqual(cts, n)
\ No newline at end of file
+                                self.assertEqual(cts, n)
+
+    def test_iter_spatial(self):
+        """
+        Tests that the spatial generator yields t+1 records with S+I+R = n
+        """
+        records = list(iter_discrete_spatial_simulation(0.05, 0.1, n=30, t=15, position='middle'))
+        self.assertEqual(len(records), 16)
+        for sus, inf, rec in records:
+            self.assertEqual(sus + inf + rec, 30)
+
+    def test_reproducible(self):
+        """
+        Tests that the same seed gives the same spatial trajectory
+        """
+        first = discrete_spatial_simulation(0.05, 0.1, n=30, t=15, rng=5)
+        second = discrete_spatial_simulation(0.05, 0.1, n=30, t=15, rng=5)
+        self.assertEqual(first, second)
+
+    def test_move_positions(self):
+        """
+        Tests that the vectorized moves have the step size of each agent and stay in the grid [0,1]x[0,1]
+        """
+        rng = np.random.default_rng(0)
+        p = np.linspace(0, 0.2, 500)
+        pos = rng.random((500, 2))
+        for i in range(20):
+            old = pos.copy()
+            move_positions(pos, p, rng)
+            dist = np.linalg.norm(pos - old, axis=1)
+            self.assertTrue(np.all((np.abs(dist - p) < 1e-12) | (dist == 0)))
+            self.assertTrue(np.all((0 <= pos) & (pos <= 1)))
+        counts = discrete_spatial_simulation(0.05, 0.1, p=np.full(30, 0.02), n=30, t=5, rng=1)
+        self.assertEqual(len(counts[0]), 6)
+
+    def test_cell_pairs(self):
+        """
+        Tests that the cell list finds exactly the pairs within q found by comparing all distances
+        """
+        rng = np.random.default_rng(1)
+        for n, q in [(300, 0.05), (300, 0.4), (40, 0.01)]:
+            pos = rng.random((n, 2))
+            pos[0] = [1, 1] # on the edge of the grid
+            a = np.arange(0, n, 2)
+            b = np.arange(1, n, 2)
+            i, j = cell_pairs(pos, a, b, q)
+            dist = np.linalg.norm(pos[a][:, None] - pos[b][None, :], axis=2)
+            x, y = np.nonzero(dist <= q)
+            self.assertEqual(sorted(zip(i, j)), sorted(zip(a[x], b[y])))
+
+    def test_cells_backend(self):
+        """
+        Tests the cell list backend: S+I+R = n, and with q covering the grid everyone is infected in one period
+        """
+        sus, inf, rec = discrete_spatial_simulation(0.05, 0.1, n=200, t=15, rng=2, backend='cells')
+        self.assertTrue(all(s + i + r == 200 for s, i, r in zip(sus, inf, rec)))
+        sus, inf, rec = discrete_spatial_simulation(0.0, 1.5, n=50, t=1, num_agents=1, rng=2, backend='cells')
+        self.assertEqual((sus[1], inf[1]), (0, 50))
+
+    def test_verlet(self):
+        """
+        Tests that Verlet lists give the same infections as finding the pairs every period, with fewer rebuilds
+        """
+        fresh = discrete_spatial_simulation(0.05, 0.05, p=0.001, n=500, t=30, rng=6, backend='cells')
+        verlet = discrete_spatial_simulation(0.05, 0.05, p=0.001, n=500, t=30, rng=6, backend='cells', skin=0.03)
+        self.assertEqual(fresh, verlet)
+        for p, skin in [(0.001, 0.03), (0.03, 0.03)]: # lists lasting about skin/(2p) = 15 periods, and too short ones
+            rng = np.random.default_rng(7)
+            pos = rng.random((500, 2))
+            state = np.zeros(500, dtype=np.uint8)
+            state[:250] = INF
+            lists = VerletList(0.05, skin)
+            for t in range(10):
+                move_positions(pos, p, rng)
+                sus, inf = lists.pairs(pos, state)
+                ref_sus, ref_inf = cell_pairs(pos, np.arange(250, 500), np.arange(250), 0.05)
+                self.assertEqual(sorted(zip(sus, inf)), sorted(zip(ref_sus, ref_inf)))
+            self.assertEqual(lists.fallback, p > skin/2)
+            self.assertTrue(lists.rebuilds < 3)
+        self.assertRaises(ValueError, discrete_spatial_simulation, 0.05, 0.05, skin=0.03)
+
+    def test_sweep(self):
+        """
+        Tests that every radius of a sweep gives the same run as discrete_spatial_simulation with backend='cells'
+        """
+        qs = [0.08, 0.03, 0.05]
+        sus, inf, rec = discrete_spatial_sweep(0.1, qs, p=0.03, n=400, t=20, rng=8)
+        self.assertEqual(sus.shape, (3, 21))
+        for r, q in enumerate(qs):
+            single = discrete_spatial_simulation(0.1, q, p=0.03, n=400, t=20, rng=8, backend='cells')
+            self.assertEqual((list(sus[r]), list(inf[r]), list(rec[r])), single)
+
+    def test_replicates(self):
+        """
+        Tests that every replicate of a batch gives the same run as discrete_spatial_simulation with backend='cells'
+        on its spawned stream (so replicates never infect each other)
+        """
+        sus, inf, rec = discrete_spatial_replicates(0.1, 0.05, p=0.03, n=300, t=20, position='corner', replicates=3,
+                                                    rng=9)
+        self.assertEqual(sus.shape, (3, 21))
+        for r, stream in enumerate(spawn_rngs(9, 3)):
+            single = discrete_spatial_simulation(0.1, 0.05, p=0.03, n=300, t=20, position='corner', rng=stream,
+                                                 backend='cells')
+            self.assertEqual((list(sus[r]), list(inf[r]), list(rec[r])), single)
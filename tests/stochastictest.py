@@ -86,3 +86,114 @@ class TestStochasticMethod(unittest.TestCase):
                     self.assertEqual(len(counts_sus), t)
                     self.assertEqual(len(counts_rec), t)
 
+    def test_iter_stochastic(self):
+        """
+        Tests that the generators yield consecutive times and agree in length with the list versions
+        """
+        for gen in [iter_stochastic_constant_contacts, iter_stochastic_fixed_contacts, iter_stochastic_random_contacts]:
+            records = list(gen(0.1, 3, N=20))
+            times = [record[3] for record in records]
+            self.assertEqual(times, list(range(1, len(records) + 1)))
+            self.assertEqual(records[-1][1], 0)
+            counts_sus, counts_inf, counts_rec, t = collect_trajectory(iter(records))
+            self.assertEqual(len(counts_sus), t)
+
+    def test_reproducible(self):
+        """
+        Tests that the same seed gives the same trajectory
+        """
+        self.assertEqual(stochastic_constant_contacts(0.1, 3, N=30, rng=3), stochastic_constant_contacts(0.1, 3, N=30, rng=3))
+        self.assertEqual(stochastic_random_contacts(0.1, 3, N=30, rng=3), stochastic_random_contacts(0.1, 3, N=30, rng=3))
+
+    def test_numpy_backend(self):
+        """
+        Tests that the vectorized engine keeps S+I+R = N and agrees on average with the loop over agents
+        """
+        for sim in [stochastic_constant_contacts, stochastic_fixed_contacts, stochastic_random_contacts]:
+            counts_sus, counts_inf, counts_rec, t = sim(0.1, 3, N=50, rng=1, backend='numpy')
+            self.assertEqual(len(counts_inf), t)
+            self.assertEqual(counts_inf[-1], 0)
+            for i in range(t):
+                self.assertEqual(counts_sus[i] + counts_inf[i] + counts_rec[i], 50)
+        rng = np.random.default_rng(2)
+        loop = np.mean([stochastic_constant_contacts(0.2, 3, N=50, rng=rng)[2][-1] for i in range(300)])
+        vectorized = np.mean([stochastic_constant_contacts(0.2, 3, N=50, rng=rng, backend='numpy')[2][-1] for i in range(300)])
+        self.assertTrue(abs(loop - vectorized) < 5) # mean final size; the standard error of the difference is below 1
+
+    def test_cohort_backend(self):
+        """
+        Tests the count-level engine: S+I+R = N, infections last exactly R+1 periods, and very large N
+        """
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.1, 3, N=50, rng=4, backend='cohort')
+        self.assertEqual(len(counts_inf), t)
+        self.assertEqual(counts_inf[-1], 0)
+        for i in range(t):
+            self.assertEqual(counts_sus[i] + counts_inf[i] + counts_rec[i], 50)
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.0, 5, N=50, backend='cohort')
+        self.assertEqual((counts_inf, t), ([1]*5 + [0], 6)) # p = 0: patient zero recovers after R+1 periods
+        counts_sus, counts_inf, counts_rec, t = stochastic_constant_contacts(0.2, 14, N=10**9, rng=4, backend='cohort')
+        self.assertEqual(counts_sus[-1] + counts_rec[-1], 10**9)
+
+    def test_grouped_infections(self):
+        """
+        Tests the grouped binomial kernel and the count-level engine for heterogeneous contacts
+        """
+        rng = np.random.default_rng(6)
+        s_levels = np.array([10, 20, 30])
+        self.assertEqual(list(grouped_infections(s_levels, [0, 1, 2], 0.0, 5, 100, rng)), [0, 0, 0])
+        self.assertEqual(list(grouped_infections(s_levels, [0, 1, 2], 1.0, 99, 100, rng)), [0, 20, 30]) # no contacts, no infection
+        for sim in [stochastic_fixed_contacts, stochastic_random_contacts]:
+            counts_sus, counts_inf, counts_rec, t = sim(0.1, 3, N=10**8, rng=rng, backend='cohort')
+            self.assertEqual(counts_inf[-1], 0)
+            self.assertEqual(counts_sus[-1] + counts_rec[-1], 10**8)
+        loop = np.mean([stochastic_random_contacts(0.05, 3, N=50, rng=rng, backend='numpy')[2][-1] for i in range(300)])
+        counts = np.mean([stochastic_random_contacts(0.05, 3, N=50, rng=rng, backend='cohort')[2][-1] for i in range(300)])
+        self.assertTrue(abs(loop - counts) < 5) # mean final size
+
+    def test_ensemble(self):
+        """
+        Tests the ensemble peaks and durations against the definitions used with stochastic_constant_contacts
+        """
+        for counts_only in [True, False]:
+            peaks, durations = stochastic_ensemble(0.0, 4, trials=20, N=30, counts_only=counts_only)
+            self.assertTrue(np.all(peaks == 1) and np.all(durations == 5)) # p = 0: patient zero recovers after R+1 periods
+            peaks, durations = stochastic_ensemble(0.3, 2, trials=200, N=30, counts_only=counts_only, rng=8)
+            self.assertTrue(np.all((1 <= peaks) & (peaks <= 30)))
+            self.assertTrue(np.all(durations >= 3))
+        rng = np.random.default_rng(9)
+        single = np.mean([stochastic_constant_contacts(0.3, 2, N=30, rng=rng, backend='numpy')[3] for i in range(300)])
+        self.assertTrue(abs(np.mean(durations) - single) < 3) # mean duration
+
+    def test_branching(self):
+        """
+        Tests the extinction probability and that the handoff from counts to agents keeps the trajectory consistent
+        """
+        self.assertEqual(extinction_probability(0.05, 2, 4), 1.0) # m = 0.6 < 1: the pandemic always dies out
+        q = extinction_probability(0.1, 2, 4)
+        self.assertTrue(abs(q - np.exp(1.2*(q - 1))) < 1e-10)
+        for backend in ['python', 'numpy']:
+            sus, inf, rec, t = stochastic_constant_contacts(0.3, 2, N=50, rng=4, backend=backend, handoff=5)
+            self.assertEqual(len(inf), t)
+            self.assertTrue(all(s + i + r == 50 for s, i, r in zip(sus, inf, rec)))
+            self.assertEqual(inf[-1], 0)
+        rng = np.random.default_rng(5)
+        minor = np.mean([stochastic_constant_contacts(0.1, 2, N=500, rng=rng, backend='numpy', handoff=10)[2][-1] < 50
+                         for i in range(300)])
+        self.assertTrue(abs(minor - q) < 0.1)
+        self.assertRaises(ValueError, stochastic_constant_contacts, 0.1, 2, backend='cohort', handoff=10)
+
+    def test_hybrid(self):
+        """
+        Tests the hybrid stochastic-ODE simulation: a threshold above N gives the count-level model,
+        and with a low threshold the pandemic still ends with the final size of the stochastic model
+        """
+        self.assertEqual(stochastic_constant_contacts_hybrid(0.2, 3, N=100, threshold=1000, rng=3),
+                         stochastic_constant_contacts(0.2, 3, N=100, rng=3, backend='cohort'))
+        sus, inf, rec, t = stochastic_constant_contacts_hybrid(0.2, 3, N=5000, threshold=50, rng=4)
+        self.assertEqual(len(inf), t)
+        self.assertEqual(inf[-1], 0)
+        self.assertTrue(all(s + i + r == 5000 for s, i, r in zip(sus, inf, rec)))
+        rng = np.random.default_rng(5)
+        hybrid = [stochastic_constant_contacts_hybrid(0.2, 3, N=5000, threshold=50, rng=rng)[2][-1] for i in range(30)]
+        cohort = [stochastic_constant_contacts(0.2, 3, N=5000, rng=rng, backend='cohort')[2][-1] for i in range(30)]
+        self.assertTrue(abs(np.median(hybrid) - np.median(cohort)) < 0.05*5000)
@@ -0,0 +1,53 @@
+import unittest
+import sys
+sys.path.append("../")
+from sir.transmission import *
+from sir.discretemodel import run_simulation
+from sir.discretemodelspatial import discrete_spatial_simulation
+from sir.stochasticsir import stochastic_constant_contacts, stochastic_random_contacts
+
+class TestTransmission(unittest.TestCase):
+
+    def test_log_models(self):
+        """
+        Tests that the logs of the agent models agree with their counts
+        """
+        log = InfectionLog(200)
+        S, I, R = run_simulation(0.005, 0.1, N=200, T=20, rng=1, log=log)
+        self.assertEqual(np.sum(log.t_inf >= 0), 200 - S[-1])
+        self.assertEqual(np.sum(log.t_rec >= 0), R[-1])
+        self.assertEqual(log.t_inf.dtype, np.int32)
+
+        log = InfectionLog(300)
+        S, I, R = discrete_spatial_simulation(0.1, 0.05, n=300, t=10, rng=1, log=log)
+        self.assertEqual(np.sum(log.t_inf >= 0), 300 - S[-1])
+        self.assertEqual(np.sum(log.infector == -1) - S[-1], 5) # only the initial infected have no infector
+
+        for backend in ['python', 'numpy']:
+            log = InfectionLog(300)
+            S, I, R, t = stochastic_constant_contacts(0.2, 4, N=300, rng=3, backend=backend, log=log)
+            self.assertEqual(np.sum(log.t_rec >= 0), R[-1])
+            self.assertTrue(np.all(log.t_rec[log.t_rec >= 0] - log.t_inf[log.t_rec >= 0] == 5)) # recover after R+1
+            self.assertTrue(np.all((1 <= generation_intervals(log)) & (generation_intervals(log) <= 5)))
+            # the infectors are drawn from their own stream, so logging leaves the counts unchanged for a seed
+            self.assertEqual((S, I, R, t), stochastic_constant_contacts(0.2, 4, N=300, rng=3, backend=backend))
+            self.assertEqual(stochastic_random_contacts(0.1, 4, N=300, rng=4, backend=backend, log=InfectionLog(300)),
+                             stochastic_random_contacts(0.1, 4, N=300, rng=4, backend=backend))
+        self.assertRaises(ValueError, stochastic_constant_contacts, 0.2, 4, backend='cohort', log=InfectionLog(200))
+
+    def test_post_processing(self):
+        """
+        Tests the post-processing functions on a small transmission tree
+        """
+        log = InfectionLog(5)
+        log.infect(0, 0) # 0 infects 1 and 2 at time 1, 1 infects 3 at time 3; 4 is never infected
+        log.infect([1, 2], 1, 0)
+        log.infect(3, 3, 1)
+        log.recover([0, 1, 2], 4)
+        self.assertEqual(list(offspring_counts(log)), [2, 1, 0, 0, 0])
+        self.assertEqual(list(offspring_distribution(log)), [1, 1, 1])
+        self.assertEqual(list(offspring_distribution(log, recovered_only=False)), [2, 1, 1])
+        self.assertEqual(sorted(generation_intervals(log)), [1, 1, 2])
+        R_t = reproduction_number(log)
+        self.assertEqual(list(R_t[[0, 1, 3]]), [2.0, 0.5, 0.0])
+        self.assertTrue(np.isnan(R_t[2]))